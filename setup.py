@@ -21,6 +21,7 @@ setup(
     install_requires=[
         'argcomplete>=1.9.5',
         'chevron',
+        'pyyaml',
     ],
     entry_points={
         'console_scripts': [
@@ -18,7 +18,26 @@ sys.path.insert(
     )
 )
 
-from vindaloo.vindaloo import Vindaloo
+from vindaloo.vindaloo import Vindaloo, CACHE_DIR_ENV, CHECK_VERSION_ENV
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(monkeypatch, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    monkeypatch.setenv(CACHE_DIR_ENV, cache_dir)
+    return cache_dir
+
+
+@pytest.fixture(autouse=True)
+def no_version_check(monkeypatch):
+    monkeypatch.setenv(CHECK_VERSION_ENV, '1')
+
+
+@pytest.fixture(autouse=True)
+def git_head():
+    # tests expect HEAD to be resolved by `git rev-parse` called through mocked Vindaloo.cmd
+    with mock.patch('vindaloo.vindaloo.git_head_commit', return_value=None) as git_head_commit:
+        yield git_head_commit
 
 
 @pytest.fixture
@@ -26,7 +45,11 @@ def loo():
     loo = Vindaloo()
     loo.cmd = mock.Mock()
     loo.cmd.return_value.returncode = 0
+    loo.spawn = mock.Mock()
+    loo.spawn.return_value.poll.return_value = 0
     loo._check_version = mock.Mock()
+    loo._live_digests = mock.Mock(return_value={})  # nothing is deployed in the cluster yet
+    loo._list_k8s_contexts = mock.Mock(return_value=set())  # contexts are checked one by one
     return loo
 
 
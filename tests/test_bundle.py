@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+import shutil
+import sys
+from unittest import mock
+
+import pytest
+
+from utils import chdir
+from vindaloo.vindaloo import Vindaloo
+
+
+def compile_bundle(loo, bundle_dir):
+    sys.argv = ['vindaloo', 'compile', '--output-dir', bundle_dir]
+    with chdir('tests/test_roots/obj-config'):
+        loo.main()
+
+    with open(os.path.join(bundle_dir, 'index.json')) as fp:
+        return json.load(fp)
+
+
+def test_compile(loo, test_temp_dir):
+    bundle_dir = os.path.join(test_temp_dir, 'bundle')
+    index = compile_bundle(loo, bundle_dir)
+
+    # only dev has configuration
+    assert set(index['targets']) == {'dev'}
+    assert set(index['targets']['dev']) == {'cluster1', 'cluster2'}
+
+    cluster1 = {(obj['type'], obj['name']): obj['digest'] for obj in index['targets']['dev']['cluster1']['objects']}
+    cluster2 = {(obj['type'], obj['name']): obj['digest'] for obj in index['targets']['dev']['cluster2']['objects']}
+    assert ('deployment', 'foo') in cluster1
+    assert index['targets']['dev']['cluster1']['deployments'] == {'foo': 600}
+
+    # service depends on the cluster, other objects are stored once for both clusters
+    assert cluster1[('service', 'foo')] != cluster2[('service', 'foo')]
+    assert cluster1[('deployment', 'foo')] == cluster2[('deployment', 'foo')]
+    objects = os.listdir(os.path.join(bundle_dir, 'objects'))
+    assert sorted(objects) == sorted(set(cluster1.values()) | set(cluster2.values()))
+
+    for digest in objects:
+        with open(os.path.join(bundle_dir, 'objects', digest), 'rb') as fp:
+            data = fp.read()
+        assert hashlib.sha256(data).hexdigest() == digest
+
+    with open(os.path.join(bundle_dir, 'objects', cluster2[('service', 'foo')])) as fp:
+        service = json.load(fp)
+    assert service['spec']['loadBalancerIP'] == '10.2.1.1'
+
+    with open(os.path.join(bundle_dir, 'objects', cluster1[('deployment', 'foo')])) as fp:
+        deployment = json.load(fp)
+    assert deployment['spec']['template']['spec']['containers'][0]['image'] == 'foo-registry.com/test/foo:1.0.0'
+
+
+def test_compile_refuses_other_dir(loo, test_temp_dir, capsys):
+    bundle_dir = os.path.join(test_temp_dir, 'bundle')
+    os.makedirs(os.path.join(bundle_dir, 'objects'))
+    with open(os.path.join(bundle_dir, 'objects', 'notes.txt'), 'w') as fp:
+        fp.write('not a manifest')
+
+    with pytest.raises(SystemExit):
+        compile_bundle(loo, bundle_dir)
+    assert 'is not empty and it is not a bundle' in capsys.readouterr().out
+    assert os.listdir(os.path.join(bundle_dir, 'objects')) == ['notes.txt']
+
+    # bundle is compiled again into the same dir
+    shutil.rmtree(bundle_dir)
+    compile_bundle(loo, bundle_dir)
+    compile_bundle(loo, bundle_dir)
+
+
+@pytest.fixture
+def deploy_host(test_temp_dir):
+    """
+    Directory with vindaloo_conf.py, but without sources and k8s configs of the component.
+    """
+    deploy_dir = os.path.join(test_temp_dir, 'deploy')
+    os.makedirs(deploy_dir)
+    shutil.copy('tests/vindaloo_conf.py', deploy_dir)
+    return deploy_dir
+
+
+def test_apply_bundle(loo, test_temp_dir, deploy_host):
+    bundle_dir = os.path.join(test_temp_dir, 'bundle')
+    index = compile_bundle(loo, bundle_dir)
+
+    deployer = Vindaloo()
+    deployer.cmd = mock.Mock()
+    deployer.cmd.return_value.returncode = 0
+    deployer._check_version = mock.Mock()
+    deployer._live_digests = mock.Mock(return_value={})
+    sys.argv = ['vindaloo', 'apply-bundle', bundle_dir, 'dev', 'c2']
+    with chdir(deploy_host), mock.patch.object(Vindaloo, '_evaluate_config') as evaluate_config:
+        deployer.main()
+    assert not evaluate_config.called
+
+    applied = [
+        call[1]['input'] for call in deployer.cmd.call_args_list
+        if call[0][0][-3:] == ['apply', '-f', '-']
+    ]
+    assert deployer.cmd.call_args_list[-1][0][0][:3] == ['kubectl', '--context', 'foo-dev:cluster2']
+    expected = []
+    for obj in index['targets']['dev']['cluster2']['objects']:
+        with open(os.path.join(bundle_dir, 'objects', obj['digest']), 'rb') as fp:
+            expected.append(fp.read())
+    assert sorted(applied) == sorted(expected)
+
+
+def test_apply_bundle_corrupted(loo, test_temp_dir, deploy_host, capsys):
+    bundle_dir = os.path.join(test_temp_dir, 'bundle')
+    index = compile_bundle(loo, bundle_dir)
+    digest = index['targets']['dev']['cluster1']['objects'][0]['digest']
+    with open(os.path.join(bundle_dir, 'objects', digest), 'ab') as fp:
+        fp.write(b' ')
+
+    sys.argv = ['vindaloo', 'apply-bundle', bundle_dir, 'dev', 'cluster1']
+    loo.cmd.reset_mock()
+    with chdir(deploy_host), pytest.raises(SystemExit):
+        loo.main()
+
+    assert 'is corrupted' in capsys.readouterr().out
+    assert not [call for call in loo.cmd.call_args_list if call[0][0][-3:] == ['apply', '-f', '-']]
+
+
+@pytest.mark.parametrize('version', ['3.0.0', '99.0.0', '4.99.0', 'dev'])
+def test_apply_bundle_incompatible(loo, test_temp_dir, deploy_host, capsys, version):
+    bundle_dir = os.path.join(test_temp_dir, 'bundle')
+    index = compile_bundle(loo, bundle_dir)
+    index['version'] = version
+    with open(os.path.join(bundle_dir, 'index.json'), 'w') as fp:
+        json.dump(index, fp)
+
+    sys.argv = ['vindaloo', 'apply-bundle', bundle_dir, 'dev', 'cluster1']
+    loo.cmd.reset_mock()
+    with chdir(deploy_host), pytest.raises(SystemExit):
+        loo.main()
+
+    assert 'was compiled by incompatible vindaloo {}'.format(version) in capsys.readouterr().out
+    assert not [call for call in loo.cmd.call_args_list if call[0][0][-3:] == ['apply', '-f', '-']]
+
+
+def test_apply_bundle_needs_login(loo, test_temp_dir, deploy_host, capsys):
+    bundle_dir = os.path.join(test_temp_dir, 'bundle')
+    compile_bundle(loo, bundle_dir)
+
+    def expired_login(command, *args, **kwargs):
+        # apply fails and `auth can-i` explains why
+        return mock.Mock(returncode=1 if 'apply' in command or 'auth' in command else 0)
+
+    sys.argv = ['vindaloo', 'apply-bundle', bundle_dir, 'dev', 'cluster1']
+    loo.cmd.reset_mock()
+    loo.cmd.side_effect = expired_login
+    with chdir(deploy_host), pytest.raises(SystemExit):
+        loo.main()
+
+    assert 'You are not logged in Kubernetes' in capsys.readouterr().out
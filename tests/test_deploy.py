@@ -1,12 +1,18 @@
 import base64
+import io
 import json
 import os
 import sys
+import threading
+from unittest import mock
 
 import pytest
-import vindaloo
 
 from utils import chdir
+import vindaloo
+from vindaloo.vindaloo import (
+    Vindaloo, DEFAULT_APPLY_WORKERS, DEFAULT_DEPLOY_WORKERS, DEFAULT_PROGRESS_DEADLINE, LIVE_DIGESTS_JSONPATH,
+)
 
 
 def test_deploy(loo):
@@ -21,14 +27,15 @@ def test_deploy(loo):
     with chdir('tests/test_roots/simple'):
         loo.main()
 
-    assert vindaloo.app.args.cluster == 'cluster1'
+    assert loo.config_module.vindaloo.app is loo
+    assert vindaloo.app is loo
+    assert loo.config_module.vindaloo.app.args.cluster == 'cluster1'
 
     # check arguments docker and kubectl was called with
-    assert len(loo.cmd.call_args_list) == 4
+    assert len(loo.cmd.call_args_list) == 3
     rev_parse_cmd = loo.cmd.call_args_list[0][0][0]
-    auth_cmd = loo.cmd.call_args_list[1][0][0]
-    use_context_cmd = loo.cmd.call_args_list[2][0][0]
-    apply_cmd = loo.cmd.call_args_list[3][0][0][0:3]
+    get_context_cmd = loo.cmd.call_args_list[1][0][0]
+    apply_cmd = loo.cmd.call_args_list[2][0][0]
 
     assert rev_parse_cmd == [
         'git',
@@ -36,24 +43,26 @@ def test_deploy(loo):
         '--short=8',
         'HEAD'
     ]
-    assert auth_cmd == [
-        'kubectl',
-        'auth',
-        'can-i',
-        'get',
-        'deployment'
-    ]
-    assert use_context_cmd == [
+    assert get_context_cmd == [
         'kubectl',
         'config',
-        'use-context',
+        'get-contexts',
         'foo-dev:cluster1',
     ]
     assert apply_cmd == [
         'kubectl',
+        '--context',
+        'foo-dev:cluster1',
+        '--namespace',
+        'foo-dev',
         'apply',
         '-f',
+        '-',
     ]
+    # templates are stamped with digest too, so they are applied as JSON
+    deployment = json.loads(loo.cmd.call_args_list[2][1]['input'])
+    assert deployment['metadata']['name'] == 'foobar'
+    assert 'vindaloo.seznam.cz/digest' in deployment['metadata']['annotations']
 
 
 def test_deploy_one_cluster(loo):
@@ -69,11 +78,10 @@ def test_deploy_one_cluster(loo):
         loo.main()
 
     # check arguments docker and kubectl was called with
-    assert len(loo.cmd.call_args_list) == 4
+    assert len(loo.cmd.call_args_list) == 3
     rev_parse_cmd = loo.cmd.call_args_list[0][0][0]
-    auth_cmd = loo.cmd.call_args_list[1][0][0]
-    use_context_cmd = loo.cmd.call_args_list[2][0][0]
-    apply_cmd = loo.cmd.call_args_list[3][0][0][0:3]
+    get_context_cmd = loo.cmd.call_args_list[1][0][0]
+    apply_cmd = loo.cmd.call_args_list[2][0][0]
 
     assert rev_parse_cmd == [
         'git',
@@ -81,23 +89,21 @@ def test_deploy_one_cluster(loo):
         '--short=8',
         'HEAD'
     ]
-    assert auth_cmd == [
-        'kubectl',
-        'auth',
-        'can-i',
-        'get',
-        'deployment'
-    ]
-    assert use_context_cmd == [
+    assert get_context_cmd == [
         'kubectl',
         'config',
-        'use-context',
+        'get-contexts',
         'foo-dev:cluster2',
     ]
     assert apply_cmd == [
         'kubectl',
+        '--context',
+        'foo-dev:cluster2',
+        '--namespace',
+        'foo-dev',
         'apply',
         '-f',
+        '-',
     ]
 
 
@@ -114,12 +120,11 @@ def test_deploy_watch(loo):
         loo.main()
 
     # check arguments docker and kubectl was called with
-    assert len(loo.cmd.call_args_list) == 5
+    assert len(loo.cmd.call_args_list) == 3
     rev_parse_cmd = loo.cmd.call_args_list[0][0][0]
-    auth_cmd = loo.cmd.call_args_list[1][0][0]
-    use_context_cmd = loo.cmd.call_args_list[2][0][0]
-    apply_cmd = loo.cmd.call_args_list[3][0][0][0:3]
-    rollout_cmd = loo.cmd.call_args_list[4][0][0]
+    get_context_cmd = loo.cmd.call_args_list[1][0][0]
+    apply_cmd = loo.cmd.call_args_list[2][0][0]
+    rollout_cmd = loo.spawn.call_args_list[0][0][0]
 
     assert rev_parse_cmd == [
         'git',
@@ -127,26 +132,28 @@ def test_deploy_watch(loo):
         '--short=8',
         'HEAD'
     ]
-    assert auth_cmd == [
-        'kubectl',
-        'auth',
-        'can-i',
-        'get',
-        'deployment'
-    ]
-    assert use_context_cmd == [
+    assert get_context_cmd == [
         'kubectl',
         'config',
-        'use-context',
+        'get-contexts',
         'foo-dev:cluster1',
     ]
     assert apply_cmd == [
         'kubectl',
+        '--context',
+        'foo-dev:cluster1',
+        '--namespace',
+        'foo-dev',
         'apply',
         '-f',
+        '-',
     ]
     assert rollout_cmd == [
         'kubectl',
+        '--context',
+        'foo-dev:cluster1',
+        '--namespace',
+        'foo-dev',
         'rollout',
         'status',
         'deployment',
@@ -164,28 +171,25 @@ def test_configmap(loo):
         loo.main()
 
     # check arguments docker and kubectl was called with
-    assert len(loo.cmd.call_args_list) == 3
-    auth_cmd = loo.cmd.call_args_list[0][0][0]
-    use_context_cmd = loo.cmd.call_args_list[1][0][0]
-    apply_cmd = loo.cmd.call_args_list[2][0][0][0:3]
+    assert len(loo.cmd.call_args_list) == 2
+    get_context_cmd = loo.cmd.call_args_list[0][0][0]
+    apply_cmd = loo.cmd.call_args_list[1][0][0]
 
-    assert auth_cmd == [
-        'kubectl',
-        'auth',
-        'can-i',
-        'get',
-        'deployment'
-    ]
-    assert use_context_cmd == [
+    assert get_context_cmd == [
         'kubectl',
         'config',
-        'use-context',
+        'get-contexts',
         'foo-dev:cluster1',
     ]
     assert apply_cmd == [
         'kubectl',
+        '--context',
+        'foo-dev:cluster1',
+        '--namespace',
+        'foo-dev',
         'apply',
         '-f',
+        '-',
     ]
 
 
@@ -227,7 +231,9 @@ def test_deploy_config_obj(loo, test_temp_dir, test_root_dir):
     with chdir(f'tests/test_roots/{test_root_dir}'):
         loo.main()
 
-    assert vindaloo.app.args.cluster == 'cluster1'
+    assert loo.config_module.vindaloo.app is loo
+    assert vindaloo.app is loo
+    assert loo.config_module.vindaloo.app.args.cluster == 'cluster1'
 
     data = json.loads(open(os.path.join(test_temp_dir, 'foo_deployment.json'), 'r').read())
 
@@ -293,3 +299,467 @@ def test_deploy_config_obj(loo, test_temp_dir, test_root_dir):
     assert data['spec']['loadBalancerIP'] == '10.1.1.1'
     assert data['metadata']['name'] == "foo"
     assert data['metadata']['annotations']['loadbalancer'] == "enabled"
+
+
+def test_deploy_batch(loo):
+    # fake arguments
+    sys.argv = ['vindaloo', '--noninteractive', 'deploy', '--batch', 'dev', 'cluster1']
+
+    applied = []
+
+    def read_applied(command, *args, **kwargs):
+        if 'apply' in command:
+            applied.append(kwargs['input'].decode('utf-8'))
+        return mock.DEFAULT
+
+    loo.cmd.side_effect = read_applied
+
+    with chdir('tests/test_roots/obj-config'):
+        loo.main()
+
+    apply_cmds = [c[0][0] for c in loo.cmd.call_args_list if 'apply' in c[0][0]]
+    assert len(apply_cmds) == 1
+
+    documents = [json.loads(doc) for doc in applied[0].split('\n---\n')]
+    assert [doc['kind'] for doc in documents] == ['Deployment', 'Service', 'CronJob', 'Job', 'Job']
+
+
+def test_deploy_batch_failure(loo):
+    # fake arguments
+    sys.argv = ['vindaloo', '--noninteractive', 'deploy', '--batch', 'dev', 'cluster1']
+
+    def fail_jobs(command, *args, **kwargs):
+        res = mock.Mock()
+        res.returncode = 0
+        if 'apply' in command and b'"kind": "Job"' in kwargs['input']:
+            res.returncode = 1
+        return res
+
+    loo.cmd.side_effect = fail_jobs
+    loo.fail = mock.Mock(side_effect=SystemExit)
+
+    with chdir('tests/test_roots/obj-config'):
+        with pytest.raises(SystemExit):
+            loo.main()
+
+    apply_cmds = [c[0][0] for c in loo.cmd.call_args_list if 'apply' in c[0][0]]
+    # one batch call and then one call per object
+    assert len(apply_cmds) == 6
+    assert loo.fail.call_args[0][0] == (
+        "Vindaloo stopped working due to objects which failed to apply: ['job foo', 'job bar']"
+    )
+
+
+def test_deploy_all_clusters(loo):
+    # fake arguments
+    sys.argv = ['vindaloo', '--noninteractive', 'deploy', '--all-clusters', 'dev']
+
+    with chdir('tests/test_roots/obj-config'):
+        loo.main()
+
+    commands = [c[0][0] for c in loo.cmd.call_args_list]
+
+    assert ['kubectl', 'config', 'get-contexts', 'foo-dev:cluster1'] in commands
+    assert ['kubectl', 'config', 'get-contexts', 'foo-dev:cluster2'] in commands
+    assert not [c for c in commands if c[:3] == ['kubectl', 'config', 'use-context']]
+
+    apply_cmds = [c for c in commands if 'apply' in c]
+    assert len(apply_cmds) == 10
+    assert len([c for c in apply_cmds if c[:3] == ['kubectl', '--context', 'foo-dev:cluster1']]) == 5
+    assert len([c for c in apply_cmds if c[:3] == ['kubectl', '--context', 'foo-dev:cluster2']]) == 5
+    assert all(c[3:5] == ['--namespace', 'foo-dev'] for c in apply_cmds)
+
+    # config is evaluated for each cluster, dev.py picks loadBalancerIP by cluster
+    services = {
+        c[0][0][2]: json.loads(c[1]['input']) for c in loo.cmd.call_args_list
+        if 'apply' in c[0][0] and json.loads(c[1]['input'])['kind'] == 'Service'
+    }
+    assert services['foo-dev:cluster1']['spec']['loadBalancerIP'] == '10.1.1.1'
+    assert services['foo-dev:cluster2']['spec']['loadBalancerIP'] == '10.2.1.1'
+
+
+def test_deploy_all_clusters_no_edit(loo, capsys):
+    # fake arguments
+    sys.argv = ['vindaloo', 'deploy', '--all-clusters', 'dev']
+
+    loo._confirm = mock.Mock(return_value=True)
+    loo._open_in_editor = mock.Mock()
+
+    with chdir('tests/test_roots/obj-config'):
+        loo.main()
+
+    # manifests differ by cluster, so editing is not offered for each of them
+    assert not loo._confirm.called
+    assert not loo._open_in_editor.called
+    assert 'not offered for editing' in capsys.readouterr().out
+    assert loo.args.noninteractive is False
+    assert len([c for c in loo.cmd.call_args_list if 'apply' in c[0][0]]) == 10
+
+
+@pytest.mark.parametrize('command', [
+    ['deploy', 'dev'], ['apply-bundle', 'bundle', 'dev'], ['build-push-deploy', 'dev'],
+])
+def test_deploy_args(loo, command):
+    with chdir('tests/test_roots/simple'):
+        loo._import_envs_config()
+    args = loo.get_arg_parser().parse_args(command)
+
+    assert args.workers == DEFAULT_DEPLOY_WORKERS
+    assert args.apply_workers == DEFAULT_APPLY_WORKERS
+    assert not args.batch and not args.all_clusters and not args.force
+    assert args.clusters is None
+
+
+def test_deploy_clusters_failure(loo, capsys):
+    # fake arguments
+    sys.argv = ['vindaloo', '--noninteractive', 'deploy', '--batch', '--clusters', 'c1,c2', 'dev']
+
+    def fail_cluster2(command, *args, **kwargs):
+        res = mock.Mock()
+        res.returncode = 1 if 'apply' in command and 'foo-dev:cluster2' in command else 0
+        return res
+
+    loo.cmd.side_effect = fail_cluster2
+    loo.fail = mock.Mock(side_effect=SystemExit)
+
+    with chdir('tests/test_roots/simple'):
+        with pytest.raises(SystemExit):
+            loo.main()
+
+    output = capsys.readouterr().out
+    assert 'cluster1: OK' in output
+    assert "cluster2: FAILED ['deployment foobar']" in output
+    assert loo.fail.call_args[0][0] == "Vindaloo stopped working due to failed clusters: ['cluster2']"
+
+
+def test_deploy_skips_unchanged(loo, capsys):
+    # fake arguments
+    sys.argv = ['vindaloo', '--noninteractive', 'deploy', 'dev', 'cluster1']
+
+    applied = []
+
+    def read_applied(command, *args, **kwargs):
+        if 'apply' in command:
+            applied.append(json.loads(kwargs['input']))
+        return mock.DEFAULT
+
+    def applies():
+        objects = list(applied)
+        applied.clear()
+        return objects
+
+    loo.cmd.side_effect = read_applied
+
+    with chdir('tests/test_roots/obj-config'):
+        loo.main()
+        first_applies = applies()
+
+        # cluster has what was applied
+        live = {
+            (obj['kind'].lower(), obj['metadata']['name']): obj['metadata']['annotations']['vindaloo.seznam.cz/digest']
+            for obj in first_applies
+        }
+        loo._live_digests.return_value = live
+        loo.main()
+        second_applies = applies()
+
+        # deployment was changed in the cluster (another deploy, rollout undo, kubectl edit) or deleted
+        changed = dict(live)
+        changed[('deployment', 'foo')] = 'other'
+        del changed[('service', 'foo')]
+        loo._live_digests.return_value = changed
+        loo.main()
+        repair_applies = [obj['kind'] for obj in applies()]
+
+        sys.argv = ['vindaloo', '--noninteractive', 'deploy', '--force', 'dev', 'cluster1']
+        loo._live_digests.return_value = live
+        loo.main()
+        forced_applies = applies()
+
+    assert len(first_applies) == 5
+    # both jobs of the config have metadata.name foo (JOB2 is a clone with changed `name` only),
+    # so they are one object in the cluster and only the last applied one matches it
+    assert [(obj['kind'], obj['spec']['template']['metadata']['name']) for obj in second_applies] == [('Job', 'foo')]
+    assert sorted(repair_applies) == ['Deployment', 'Job', 'Service']
+    assert len(forced_applies) == 5
+    assert 'skipping deployment foo, unchanged in the cluster...' in capsys.readouterr().out
+
+
+def test_live_digests(loo):
+    loo.args = mock.Mock()
+    loo.args.dryrun = False
+    loo.cmd.return_value.stdout = b'Deployment\tfoo\tabc\nService\tfoo\t\nCronJob\tbar\tdef\n'
+    kubectl = ['kubectl', '--context', 'foo-dev:cluster1', '--namespace', 'foo-dev']
+    manifests = [
+        {'stamp': ['deployment', 'foo', 'abc']},
+        {'stamp': ['cronjob', 'bar', 'xyz']},
+        {'stamp': None},
+    ]
+
+    assert Vindaloo._live_digests(loo, manifests, kubectl) == {('deployment', 'foo'): 'abc', ('cronjob', 'bar'): 'def'}
+    command = loo.cmd.call_args[0][0]
+    assert command[:7] == kubectl + ['get', 'cronjob,deployment']
+    assert command[7:9] == ['-o', 'jsonpath={}'.format(LIVE_DIGESTS_JSONPATH)]
+
+    # kind unknown to the cluster, nothing is skipped
+    loo.cmd.return_value.returncode = 1
+    assert Vindaloo._live_digests(loo, manifests, kubectl) == {}
+
+
+def test_deploy_digest_annotation(loo, test_temp_dir):
+    # fake arguments
+    sys.argv = ['vindaloo', '--noninteractive', 'deploy-dir', '--apply-output-dir={}'.format(test_temp_dir), 'dev', 'cluster1']
+
+    with chdir('tests/test_roots/obj-config'):
+        loo.main()
+
+    with open(os.path.join(test_temp_dir, 'foo_deployment.json'), 'r') as fp:
+        data = json.load(fp)
+
+    digest = data['metadata']['annotations'].pop('vindaloo.seznam.cz/digest')
+    assert len(digest) == 64
+    assert loo._digest(json.dumps(data, sort_keys=True).encode('utf-8')) == digest
+
+
+def test_stamp_yaml_manifest(loo):
+    manifest = b'kind: Deployment\nmetadata:\n  name: foo\n  annotations:\n    released: 2023-01-01\n'
+
+    data, stamp = loo._stamp_manifest(manifest)
+
+    document = json.loads(data.decode('utf-8'))
+    assert document['metadata']['annotations']['released'] == '2023-01-01'
+    assert stamp == ['deployment', 'foo', document['metadata']['annotations']['vindaloo.seznam.cz/digest']]
+
+    # can't be serialized as JSON, applied as it is
+    manifest = b'kind: Deployment\nmetadata:\n  name: foo\n  labels:\n    1: a\n    b: 2\n'
+    assert loo._stamp_manifest(manifest) == (manifest, None)
+    assert loo._stamp_manifest(b'kind: [') == (b'kind: [', None)
+
+
+def test_deploy_tiers_concurrent(loo):
+    # fake arguments
+    sys.argv = ['vindaloo', '--noninteractive', 'deploy', 'dev', 'cluster1']
+
+    # both jobs are in the same tier, so they have to be applied at the same time
+    barrier = threading.Barrier(2, timeout=5)
+
+    def apply(command, *args, **kwargs):
+        if 'apply' in command and b'"kind": "Job"' in kwargs['input']:
+            barrier.wait()
+        return mock.DEFAULT
+
+    loo.cmd.side_effect = apply
+
+    with chdir('tests/test_roots/obj-config'):
+        loo.main()
+
+    assert len([c for c in loo.cmd.call_args_list if 'apply' in c[0][0]]) == 5
+
+
+def test_deploy_tiers_barrier(loo):
+    # fake arguments
+    sys.argv = ['vindaloo', '--noninteractive', 'deploy', 'dev', 'cluster1']
+
+    applied_kinds = []
+
+    def fail_deployment(command, *args, **kwargs):
+        res = mock.Mock()
+        res.returncode = 0
+        if 'apply' in command:
+            kind = json.loads(kwargs['input'])['kind']
+            applied_kinds.append(kind)
+            if kind == 'Deployment':
+                res.returncode = 1
+        return res
+
+    loo.cmd.side_effect = fail_deployment
+    loo.fail = mock.Mock(side_effect=SystemExit)
+
+    with chdir('tests/test_roots/obj-config'):
+        with pytest.raises(SystemExit):
+            loo.main()
+
+    assert applied_kinds == ['Deployment']
+    assert loo.fail.call_args[0][0] == "Vindaloo stopped working due to objects which failed to apply: ['deployment foo']"
+
+
+def test_deploy_edit_manifest(loo):
+    # fake arguments
+    sys.argv = ['vindaloo', 'deploy', 'dev', 'cluster1']
+
+    def edit(temp_file):
+        with open(temp_file.name, 'wb') as fp:
+            fp.write(b'edited')
+
+    loo._confirm = mock.Mock(return_value=True)
+    loo._open_in_editor = mock.Mock(side_effect=edit)
+
+    with chdir('tests/test_roots/simple'):
+        loo.main()
+
+    apply_call = [c for c in loo.cmd.call_args_list if 'apply' in c[0][0]][0]
+    assert apply_call[0][0][-3:] == ['apply', '-f', '-']
+    assert apply_call[1]['input'] == b'edited'
+
+
+def test_watch_deployments_fail_fast(loo, capsys):
+    loo.args = mock.Mock()
+    loo.args.quiet = False
+
+    def process(returncodes, output=b''):
+        def spawn(command, stdout):
+            stdout.write(output)
+            stdout.flush()
+            proc = mock.Mock()
+            proc.poll.side_effect = returncodes
+            return proc
+        return spawn
+
+    spawned = [
+        process([None, None, 0]),
+        process([None, 1], b'error: deployment "bar" exceeded its progress deadline'),
+        process([None, None, None]),
+    ]
+    loo.spawn = mock.Mock(side_effect=lambda command, stdout: spawned.pop(0)(command, stdout))
+
+    with mock.patch('vindaloo.vindaloo.ROLLOUT_POLL_INTERVAL', 0):
+        failed = loo._watch_deployments({'foo': 600, 'bar': 600, 'baz': 600}, ['kubectl'])
+
+    assert failed == ['bar']
+    assert [c[0][0] for c in loo.spawn.call_args_list] == [
+        ['kubectl', 'rollout', 'status', 'deployment', 'foo'],
+        ['kubectl', 'rollout', 'status', 'deployment', 'bar'],
+        ['kubectl', 'rollout', 'status', 'deployment', 'baz'],
+    ]
+
+    output = capsys.readouterr().out
+    assert 'bar: error: deployment "bar" exceeded its progress deadline' in output
+    assert 'Stopped waiting for: foo, baz' in output
+
+
+def test_watch_deployments_deadline(loo, capsys):
+    loo.args = mock.Mock()
+    loo.args.quiet = False
+    loo.spawn.return_value.poll.return_value = None
+
+    with mock.patch('vindaloo.vindaloo.ROLLOUT_POLL_INTERVAL', 0):
+        failed = loo._watch_deployments({'foo': 0}, ['kubectl'])
+
+    assert failed == ['foo']
+    assert loo.spawn.return_value.terminate.called
+    assert 'foo: not rolled out in 0 seconds' in capsys.readouterr().out
+
+
+def test_watched_template_deadline(loo):
+    loo.config_module = mock.Mock()
+    loo.config_module.K8S_OBJECTS = {'deployment': [
+        {'file': 'deployment.yaml', 'config': {'ident_label': 'foo'}},
+        {'file': 'deployment.yaml', 'config': {'ident_label': 'bar'}},
+    ]}
+    rendered = {'kind': 'Deployment', 'metadata': {'name': 'foo'}, 'spec': {'progressDeadlineSeconds': 120}}
+    manifests = [
+        {'type': 'deployment', 'name': 'foo', 'data': json.dumps(rendered).encode('utf-8'), 'digest': 'abc',
+         'stamp': ['deployment', 'foo', 'abc']},
+        {'type': 'deployment', 'name': 'bar', 'data': b'kind: Deployment', 'digest': None, 'stamp': None},
+    ]
+
+    assert loo._watched_objects(manifests) == ({'foo': 120, 'bar': DEFAULT_PROGRESS_DEADLINE}, [])
+
+
+def test_watch_jobs(loo, capsys):
+    loo.args = mock.Mock()
+    loo.args.quiet = False
+    loo.args.dryrun = False
+
+    streams = [
+        b'foo\t\t\nother\t1\t\nfoo\t1\t\n',  # watch drops before bar finishes
+        b'bar\t\t\nbar\t\t1\n',
+    ]
+
+    def spawn(command, stdout):
+        proc = mock.Mock()
+        proc.stdout = io.BytesIO(streams.pop(0))
+        return proc
+
+    loo.spawn = mock.Mock(side_effect=spawn)
+
+    with mock.patch('vindaloo.vindaloo.JOB_WATCH_MIN_BACKOFF', 0):
+        failed = loo._watch_jobs(['foo', 'bar'], ['kubectl', '--context', 'foo-dev:cluster1'])
+
+    assert failed == ['bar']
+    assert loo.spawn.call_count == 2
+    assert loo.spawn.call_args[0][0][:6] == ['kubectl', '--context', 'foo-dev:cluster1', 'get', 'jobs', '--watch']
+
+    output = capsys.readouterr().out
+    assert 'Job foo ended successfully.' in output
+    assert 'Job bar failed.' in output
+    assert 'other' not in output
+
+
+def test_watch_jobs_gives_up(loo, capsys):
+    loo.args = mock.Mock()
+    loo.args.quiet = False
+    loo.args.dryrun = False
+    loo.spawn.return_value.stdout = io.BytesIO(b'')
+
+    with mock.patch('vindaloo.vindaloo.JOB_WATCH_MIN_BACKOFF', 0):
+        failed = loo._watch_jobs(['foo'], ['kubectl'])
+
+    assert failed == ['foo']
+    assert loo.spawn.call_count == 11
+    assert 'unknown result of jobs: foo' in capsys.readouterr().out
+
+
+def test_watch_jobs_dryrun(loo, capsys):
+    loo.args = mock.Mock()
+    loo.args.quiet = False
+    loo.args.dryrun = True
+
+    with mock.patch('time.sleep') as sleep:
+        failed = loo._watch_jobs(['foo'], ['kubectl'])
+
+    assert failed == []
+    loo.spawn.assert_not_called()
+    sleep.assert_not_called()
+    assert 'Waiting for jobs foo to finish' in capsys.readouterr().out
+
+
+def test_deploy_not_logged_in(loo):
+    # fake arguments
+    sys.argv = ['vindaloo', '--noninteractive', 'deploy', 'dev', 'cluster1']
+
+    def not_logged_in(command, *args, **kwargs):
+        res = mock.Mock()
+        res.returncode = 1 if 'apply' in command or 'auth' in command else 0
+        return res
+
+    loo.cmd.side_effect = not_logged_in
+    loo.fail = mock.Mock(side_effect=SystemExit)
+
+    with chdir('tests/test_roots/simple'):
+        with pytest.raises(SystemExit):
+            loo.main()
+
+    assert loo.cmd.call_args[0][0][-4:] == ['auth', 'can-i', 'get', 'deployment']
+    assert loo.fail.call_args[0][0] == 'You are not logged in Kubernetes'
+
+
+def test_deploy_login_cached(loo):
+    # fake arguments
+    sys.argv = ['vindaloo', '--noninteractive', 'deploy', 'dev', 'cluster1']
+
+    with chdir('tests/test_roots/simple'):
+        loo.main()
+
+        # successful apply proved the login, another process does not need to check it again
+        loo = Vindaloo()
+        loo.cmd = mock.Mock()
+        loo.cmd.side_effect = lambda command, *args, **kwargs: mock.Mock(returncode=1 if 'apply' in command else 0)
+        loo._check_version = mock.Mock()
+        loo._live_digests = mock.Mock(return_value={})
+        loo.fail = mock.Mock(side_effect=SystemExit)
+        with pytest.raises(SystemExit):
+            loo.main()
+
+    assert not [c for c in loo.cmd.call_args_list if 'auth' in c[0][0]]
+    assert loo.fail.call_args[0][0] == "Vindaloo stopped working due to objects which failed to apply: ['deployment foobar']"
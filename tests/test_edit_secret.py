@@ -1,5 +1,6 @@
 import json
 import sys
+from unittest import mock
 
 import pytest
 from utils import chdir
@@ -50,8 +51,18 @@ def test_parse_secrets(loo):
 
 def test_commit_secret_values(loo):
 
+    loo.envs_config_module = mock.Mock()
+    loo.envs_config_module.ENVS = {'dev': {'k8s_namespace': 'foo-dev', 'k8s_clusters': ['cluster1']}}
+    loo.envs_config_module.K8S_CLUSTER_ALIASES = {'c1': 'cluster1'}
+    loo.args = mock.Mock()
+    loo.args.environment = 'dev'
+    loo.args.cluster = 'c1'
+
     with chdir('tests/test_roots/simple'):
         loo.changed_secrets = {"a": b"b"}
         with pytest.raises(RefreshException):
             loo._commit_secret_values({"name": "XXX"})
-        assert loo.cmd.call_args[0][0] == ['kubectl', 'patch', 'secret', 'XXX',  '-p', '{"data":{"a":"Yg=="}}']
\ No newline at end of file
+        assert loo.cmd.call_args[0][0] == [
+            'kubectl', '--context', 'foo-dev:cluster1', '--namespace', 'foo-dev',
+            'patch', 'secret', 'XXX',  '-p', '{"data":{"a":"Yg=="}}'
+        ]
\ No newline at end of file
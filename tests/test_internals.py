@@ -1,6 +1,20 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
 from unittest import mock
 
-from vindaloo.vindaloo import Vindaloo
+import pytest
+
+from utils import chdir
+import vindaloo
+from vindaloo.utils import ConfigLoader, NamespaceWithDefaultValue, git_head_commit
+from vindaloo.vindaloo import (
+    Vindaloo, CHECK_VERSION_CACHE_FILE, CHECK_VERSION_ENV, CHECK_VERSION_INTERVAL, ENVS_CONFIG_PATHS_FILE,
+)
 
 
 def test_cmd():
@@ -47,3 +61,415 @@ def test_fail(mock_sys_exit, capsys):
     output = capsys.readouterr().out.strip()
     assert output == 'msg'
     assert mock_sys_exit.call_args[0][0] == -1
+
+
+def test_timings(loo, capsys):
+    sys.argv = ['vindaloo', '--noninteractive', '--timings', 'deploy', 'dev', 'cluster1']
+
+    with chdir('tests/test_roots/obj-config'):
+        loo.main()
+
+    output = capsys.readouterr().err
+    assert 'env config import' in output
+    assert 'object serialization' in output
+    assert 'total (wall time)' in output
+    assert [line for line in output.splitlines() if line.startswith('kubectl apply')][0].split()[2] == '5'
+
+
+def test_timings_json(loo, capsys, test_temp_dir):
+    sys.argv = [
+        'vindaloo', '--noninteractive', '--timings-json',
+        'deploy-dir', '--apply-output-dir={}'.format(test_temp_dir), 'dev', 'cluster1',
+    ]
+
+    with chdir('tests/test_roots/configmap'):
+        loo.main()
+
+    data = json.loads(capsys.readouterr().err)
+    assert data['command'] == 'deploy-dir'
+    assert data['phases']['kubectl apply']['calls'] == 1
+    assert data['phases']['template rendering']['calls'] == 1
+    assert 'docker build' not in data['phases']
+
+
+def test_import_config_once(loo, capsys):
+    sys.argv = ['vindaloo', '--timings-json', 'versions', 'dev']
+    loo.cmd.return_value.stdout = b'{}'
+
+    with chdir('tests/test_roots/simple'):
+        loo.main()
+
+        # base and dev, although dev is needed for both local and remote versions
+        data = json.loads(capsys.readouterr().err)
+        assert data['phases']['env config import']['calls'] == 2
+
+        dev_config = loo._import_config('dev')
+        assert loo._import_config('dev') is dev_config
+
+        loo.invalidate_config('dev')
+        assert loo._import_config('dev') is not dev_config
+
+
+def test_import_envs_config_cached(test_temp_dir, cache_dir):
+    project_dir = os.path.join(test_temp_dir, 'a', 'b')
+    os.makedirs(project_dir)
+    conf_path = os.path.join(test_temp_dir, 'vindaloo_conf.py')
+    with open(conf_path, 'w') as fp:
+        fp.write("ENVS = {'dev': {}}\n")
+
+    with chdir(project_dir):
+        loo = Vindaloo()
+        loo._import_envs_config()
+        assert loo.envs_config_module.ENVS == {'dev': {}}
+
+        # found path is remembered in the cache dir, so the next invocation does not walk the parent dirs
+        loo2 = Vindaloo()
+        with mock.patch('os.path.isfile', wraps=os.path.isfile) as isfile:
+            loo2._import_envs_config()
+        assert not isfile.called
+        assert loo2.envs_config_module.ENVS == {'dev': {}}
+        with open(os.path.join(cache_dir, ENVS_CONFIG_PATHS_FILE), 'r') as fp:
+            assert json.load(fp) == {os.path.abspath(project_dir): [conf_path, os.stat(conf_path).st_mtime_ns]}
+
+        # changed file is loaded again
+        with open(conf_path, 'w') as fp:
+            fp.write("ENVS = {'test': {}}\n")
+        os.utime(conf_path, ns=(0, os.stat(conf_path).st_mtime_ns + 1))
+        loo3 = Vindaloo()
+        loo3._import_envs_config()
+        assert loo3.envs_config_module.ENVS == {'test': {}}
+
+
+def write_file(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as fp:
+        fp.write(content)
+
+
+def test_git_head_commit(test_temp_dir):
+    repo = os.path.join(test_temp_dir, 'repo')
+    component = os.path.join(repo, 'component')
+    os.makedirs(component)
+    git_dir = os.path.join(repo, '.git')
+    loose, packed, detached = 'a' * 40, 'b' * 40, 'c' * 40
+
+    # loose ref
+    write_file(os.path.join(git_dir, 'HEAD'), 'ref: refs/heads/master\n')
+    write_file(os.path.join(git_dir, 'refs', 'heads', 'master'), loose + '\n')
+    assert git_head_commit(component) == loose
+
+    # packed-refs
+    write_file(os.path.join(git_dir, 'HEAD'), 'ref: refs/heads/packed\n')
+    write_file(os.path.join(git_dir, 'packed-refs'), '# pack-refs with: peeled\n{} refs/heads/packed\n^{}\n'.format(
+        packed, 'd' * 40
+    ))
+    assert git_head_commit(component) == packed
+
+    # detached HEAD
+    write_file(os.path.join(git_dir, 'HEAD'), detached + '\n')
+    assert git_head_commit(component) == detached
+
+    # worktree: .git file pointing to gitdir with commondir
+    worktree = os.path.join(test_temp_dir, 'worktree')
+    worktree_git_dir = os.path.join(git_dir, 'worktrees', 'worktree')
+    write_file(os.path.join(worktree, '.git'), 'gitdir: {}\n'.format(worktree_git_dir))
+    write_file(os.path.join(worktree_git_dir, 'HEAD'), 'ref: refs/heads/master\n')
+    write_file(os.path.join(worktree_git_dir, 'commondir'), '../..\n')
+    assert git_head_commit(worktree) == loose
+
+    # unknown layout is left to git binary
+    os.makedirs(os.path.join(git_dir, 'reftable'))
+    assert git_head_commit(component) is None
+    assert git_head_commit(test_temp_dir) is None
+
+
+def test_git_short_hash_without_git(loo, git_head):
+    git_head.return_value = '0123456789abcdef0123456789abcdef01234567'
+    assert loo._git_short_hash() == '01234567'
+    assert not loo.cmd.called
+
+
+# wall-clock budget is checked only on request, shared CI runners are too noisy for it
+# generous for slow CI machines, the import takes tens of milliseconds; tighten it by the env variable
+IMPORT_TIME_BUDGET_US = int(os.getenv('VINDALOO_IMPORT_TIME_BUDGET_US', 300000))
+LAZY_MODULES = (
+    'argcomplete', 'chevron', 'concurrent.futures', 'hashlib', 'ssl', 'subprocess', 'tempfile', 'urllib.request',
+    'vindaloo.convert', 'vindaloo.examples',
+)
+
+
+def test_lazy_imports():
+    res = subprocess.run(
+        [sys.executable, '-c', 'import sys, vindaloo.vindaloo; print(" ".join(sys.modules))'],
+        cwd=os.path.join(os.path.dirname(__file__), '..'),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    assert res.returncode == 0, res.stderr
+
+    # heavy modules are imported only by commands which need them
+    imported = set(res.stdout.decode().split())
+    assert not imported.intersection(LAZY_MODULES)
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason='-X importtime is available since python 3.7')
+def test_import_time():
+    res = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import vindaloo.vindaloo'],
+        cwd=os.path.join(os.path.dirname(__file__), '..'),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    assert res.returncode == 0, res.stderr
+
+    # "import time: self [us] | cumulative | imported package", the last line is the top level import
+    cumulative = int(res.stderr.decode().strip().splitlines()[-1].split('|')[1])
+    assert cumulative < IMPORT_TIME_BUDGET_US
+
+
+def test_ensure_k8s_context_listed_once(loo):
+    loo.args = mock.Mock()
+    loo.args.dryrun = False
+    loo.envs_config_module = mock.Mock()
+    loo.envs_config_module.ENVS = {
+        'dev': {'k8s_namespace': 'foo-dev', 'k8s_clusters': ['cluster1', 'cluster2']},
+    }
+    loo.envs_config_module.K8S_CLUSTER_ALIASES = {}
+    del loo._list_k8s_contexts  # real listing instead of the fixture's one
+
+    def cmd(command, *args, **kwargs):
+        res = mock.Mock()
+        res.returncode = 0
+        if command == ['kubectl', 'config', 'get-contexts', '-o', 'name']:
+            res.stdout = b'foo-dev:cluster1\nother:cluster1\n'
+        elif command == ['kubectl', 'config', 'get-contexts', 'foo-dev:cluster2']:
+            res.returncode = 1
+        return res
+    loo.cmd.side_effect = cmd
+    loo._create_k8s_context = mock.Mock()
+
+    assert loo._ensure_k8s_context('dev', 'cluster1') == 'foo-dev:cluster1'
+    assert loo._ensure_k8s_context('dev', 'cluster2') == 'foo-dev:cluster2'
+    assert loo._ensure_k8s_context('dev', 'cluster2') == 'foo-dev:cluster2'
+
+    # missing context is confirmed by kubectl before it is created
+    assert [call[0][0] for call in loo.cmd.call_args_list] == [
+        ['kubectl', 'config', 'get-contexts', '-o', 'name'],
+        ['kubectl', 'config', 'get-contexts', 'foo-dev:cluster2'],
+    ]
+    loo._create_k8s_context.assert_called_once_with('dev', 'cluster2')
+
+
+def latest_version_response(version):
+    response = mock.MagicMock()
+    response.__enter__.return_value.read.return_value = json.dumps({'version': version}).encode()
+    return response
+
+
+def test_check_version_in_background(monkeypatch, cache_dir, capsys):
+    monkeypatch.delenv(CHECK_VERSION_ENV)
+    loo = Vindaloo()
+
+    with mock.patch('urllib.request.urlopen', return_value=latest_version_response('99.0.0')) as urlopen:
+        loo._check_version()
+        loo.version_check.join()
+    assert urlopen.called
+    assert loo.latest_version == '99.0.0'
+    with open(os.path.join(cache_dir, CHECK_VERSION_CACHE_FILE)) as fp:
+        assert json.load(fp)['version'] == '99.0.0'
+
+    loo._print_newer_version()
+    assert 'Newer version found: 99.0.0' in capsys.readouterr().out
+
+    # remembered version is used without fetching
+    loo2 = Vindaloo()
+    with mock.patch('urllib.request.urlopen') as urlopen:
+        loo2._check_version()
+    assert not urlopen.called
+    assert loo2.version_check is None
+    assert loo2.latest_version == '99.0.0'
+
+
+def test_check_version_cache_expired(monkeypatch, cache_dir):
+    monkeypatch.delenv(CHECK_VERSION_ENV)
+    write_file(os.path.join(cache_dir, CHECK_VERSION_CACHE_FILE), json.dumps({
+        'time': time.time() - CHECK_VERSION_INTERVAL - 1, 'version': '98.0.0',
+    }))
+    loo = Vindaloo()
+
+    with mock.patch('urllib.request.urlopen', side_effect=OSError) as urlopen:
+        loo._check_version()
+        loo.version_check.join()
+    assert urlopen.called
+    assert loo.latest_version is None
+
+    # failure is remembered too (with the last known version), so unreachable url does not cost anything
+    with open(os.path.join(cache_dir, CHECK_VERSION_CACHE_FILE)) as fp:
+        cached = json.load(fp)
+    assert cached['version'] == '98.0.0'
+    assert time.time() - cached['time'] < CHECK_VERSION_INTERVAL
+
+
+def test_check_version_attempt_recorded(monkeypatch, cache_dir):
+    monkeypatch.delenv(CHECK_VERSION_ENV)
+    loo = Vindaloo()
+
+    # command ends before the fetch does, daemon thread never gets to write its result
+    with mock.patch('threading.Thread') as thread:
+        loo._check_version()
+    assert thread.return_value.start.called
+
+    loo2 = Vindaloo()
+    with mock.patch('threading.Thread') as thread:
+        loo2._check_version()
+    assert not thread.called
+    assert loo2.latest_version is None
+
+
+def test_check_version_disabled(monkeypatch):
+    loo = Vindaloo()
+    with mock.patch('threading.Thread') as thread:
+        loo._check_version()
+    assert not thread.called
+
+    monkeypatch.delenv(CHECK_VERSION_ENV)
+    loo.envs_config_module = mock.Mock(CHECK_VERSION=False)
+    with mock.patch('threading.Thread') as thread:
+        loo._check_version()
+    assert not thread.called
+
+
+def test_config_loader_isolated(test_temp_dir):
+    config_dir = os.path.join(test_temp_dir, 'k8s')
+    write_file(os.path.join(config_dir, 'base.py'), '\n'.join([
+        'import vindaloo',
+        'from vindaloo.objects import Deployment',
+        'from helpers import tag',
+        'vindaloo.app.barrier.wait()  # both envs are evaluated at the same time',
+        'DEPLOYMENT = Deployment(name=vindaloo.app.name, containers={"foo": {"image": tag("foo")}})',
+    ]))
+    # relative imports within package of the config dir
+    write_file(os.path.join(config_dir, 'helpers', '__init__.py'), 'from .tags import tag\nfrom . import tags\n')
+    write_file(os.path.join(config_dir, 'helpers', 'tags.py'), 'import vindaloo\n\n\ndef tag(image):\n'
+               '    return "{}:{}".format(image, vindaloo.app.versions[image])\n')
+    write_file(os.path.join(config_dir, 'dev.py'), 'from base import *\n')
+    write_file(os.path.join(config_dir, 'test.py'), 'from base import *\n')
+    sys_path = list(sys.path)
+
+    barrier = threading.Barrier(2, timeout=5)
+    results = {}
+
+    def evaluate(env, version):
+        app = mock.Mock(barrier=barrier, versions={'foo': version})
+        app.name = env
+        results[env] = (app, ConfigLoader(config_dir, app).load(env))
+
+    threads = [threading.Thread(target=evaluate, args=args) for args in (('dev', '1.0'), ('test', '2.0'))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for env, version in (('dev', '1.0'), ('test', '2.0')):
+        app, config = results[env]
+        assert config.vindaloo.app is app
+        assert config.DEPLOYMENT.metadata.name == env
+        assert config.DEPLOYMENT.spec.template.spec.containers['foo'].image == 'foo:{}'.format(version)
+
+    # each env has its own base and nothing leaks to global state
+    assert results['dev'][1].DEPLOYMENT is not results['test'][1].DEPLOYMENT
+    assert sys.path == sys_path
+    assert not {'base', 'dev', 'test', 'helpers'}.intersection(sys.modules)
+    assert vindaloo.app is not results['dev'][0]
+
+    assert ConfigLoader(config_dir, None).load('missing') is None
+
+
+def test_config_snapshot_per_environment(test_temp_dir):
+    write_file(
+        os.path.join(test_temp_dir, 'vindaloo_conf.py'), "ENVS = {'dev': {}, 'stable': {}}\nCONFIG_SNAPSHOTS = True\n"
+    )
+    project_dir = os.path.join(test_temp_dir, 'project')
+    write_file(os.path.join(project_dir, 'k8s', 'versions.json'), '{}')
+    write_file(os.path.join(project_dir, 'k8s', 'base.py'), '\n'.join([
+        'import vindaloo',
+        "DOCKER_FILES = [{'config': {'env_name': vindaloo.app.args.environment}}]",
+    ]))
+
+    def env_name(environment):
+        loo = Vindaloo()
+        loo.args = NamespaceWithDefaultValue(argparse.Namespace(environment=environment))
+        loo._import_envs_config()
+        return loo._config_snapshot('base').DOCKER_FILES[0]['config']['env_name']
+
+    with chdir(project_dir):
+        # config reads selected environment, so snapshot of another environment must not be used
+        assert env_name('dev') == 'dev'
+        assert env_name('stable') == 'stable'
+        assert env_name('dev') == 'dev'
+
+
+@pytest.mark.parametrize('snapshots', ['', 'CONFIG_SNAPSHOTS = False\n'])
+def test_config_snapshot_disabled(test_temp_dir, snapshots):
+    write_file(os.path.join(test_temp_dir, 'vindaloo_conf.py'), "ENVS = {'dev': {}}\n" + snapshots)
+    project_dir = os.path.join(test_temp_dir, 'project')
+    write_file(os.path.join(project_dir, 'k8s', 'versions.json'), '{}')
+    write_file(os.path.join(project_dir, 'k8s', 'base.py'), "import os\nDOCKER_FILES = [os.environ['TAG']]\n")
+
+    def docker_files(tag):
+        loo = Vindaloo()
+        loo.args = NamespaceWithDefaultValue(argparse.Namespace())
+        loo._import_envs_config()
+        with mock.patch.dict(os.environ, {'TAG': tag}):
+            return loo._config_snapshot('base').DOCKER_FILES
+
+    with chdir(project_dir):
+        # snapshots are opt-in, config reading env variables is evaluated every time
+        assert docker_files('1.0.0') == ['1.0.0']
+        assert docker_files('2.0.0') == ['2.0.0']
+
+
+def test_config_snapshot_permissions(test_temp_dir):
+    write_file(os.path.join(test_temp_dir, 'vindaloo_conf.py'), "ENVS = {'dev': {}}\nCONFIG_SNAPSHOTS = True\n")
+    project_dir = os.path.join(test_temp_dir, 'project')
+    write_file(os.path.join(project_dir, 'k8s', 'versions.json'), '{}')
+    write_file(os.path.join(project_dir, 'k8s', 'base.py'), "DOCKER_FILES = ['evaluated']\n")
+
+    def snapshot():
+        loo = Vindaloo()
+        loo.args = NamespaceWithDefaultValue(argparse.Namespace())
+        loo._import_envs_config()
+        loo._evaluate_config = mock.Mock(wraps=loo._evaluate_config)
+        loo._config_snapshot('base')
+        return loo._config_snapshot_path('base'), loo._evaluate_config.called
+
+    with chdir(project_dir):
+        path, evaluated = snapshot()
+        assert evaluated
+        assert os.stat(path).st_mode & 0o777 == 0o600
+        assert snapshot() == (path, False)
+
+        # snapshot writable by others is not trusted
+        os.chmod(path, 0o666)
+        assert snapshot() == (path, True)
+        assert os.stat(path).st_mode & 0o777 == 0o600
+
+        # neither is snapshot of another user
+        with mock.patch('os.getuid', return_value=os.getuid() + 1):
+            assert snapshot() == (path, True)
+
+
+def test_evaluate_config_missing_module(loo, test_temp_dir):
+    write_file(os.path.join(test_temp_dir, 'k8s', 'versions.json'), '{}')
+    write_file(os.path.join(test_temp_dir, 'k8s', 'dev.py'), 'import dev_missing\n')
+    write_file(os.path.join(test_temp_dir, 'k8s', 'test.py'), 'import other_missing\n')
+    loo.fail = mock.Mock(side_effect=SystemExit)
+
+    with chdir(test_temp_dir):
+        assert loo._evaluate_config('dev') is None
+        assert loo._evaluate_config('stable') is None
+        assert not loo.fail.called
+
+        with pytest.raises(SystemExit):
+            loo._evaluate_config('test')
+        assert 'other_missing' in loo.fail.call_args[0][0]
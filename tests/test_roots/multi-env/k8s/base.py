@@ -0,0 +1,31 @@
+import vindaloo
+from vindaloo.objects import Deployment
+
+versions = vindaloo.app.versions
+
+CONFIG = {
+    'maintainer': "Foo <test@foo.com>",
+    'version': versions['test/foo'],
+    'image_name': 'test/foo',
+}
+
+DEPLOYMENT = Deployment(
+    name="foo",
+    containers={
+        'foo': {
+            'image': "{}:{}".format(CONFIG['image_name'], CONFIG['version']),
+        },
+    },
+)
+
+DOCKER_FILES = [
+    {
+        'context_dir': "..",
+        'config': CONFIG,
+        'template': "Dockerfile",
+    },
+]
+
+K8S_OBJECTS = {
+    "deployment": [DEPLOYMENT],
+}
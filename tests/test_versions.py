@@ -1,71 +1,126 @@
+import io
 import json
+import os
+import shutil
+import subprocess
 import sys
+import threading
+import types
 from unittest import mock
 
+import pytest
+
 from utils import chdir
-from vindaloo.vindaloo import Vindaloo
+from vindaloo.vindaloo import Vindaloo, VERSIONS_WATCH_JSONPATH
+
+
+def pod_spec(images):
+    return {'spec': {'containers': [{'name': 'c{}'.format(i), 'image': image} for i, image in enumerate(images.split())]}}
+
+
+def deployments_json(cronjobs=None, **deployments):
+    """
+    Odpoved `kubectl get deployments,cronjobs,jobs -o json` s danymi images
+    """
+    return json.dumps({
+        'items': [
+            {'kind': 'Deployment', 'metadata': {'name': name}, 'spec': {'template': pod_spec(images)}}
+            for name, images in deployments.items()
+        ] + [
+            {'kind': 'CronJob', 'metadata': {'name': name}, 'spec': {'jobTemplate': {'spec': {'template': pod_spec(images)}}}}
+            for name, images in (cronjobs or {}).items()
+        ]
+    }).encode('utf-8')
+
+
+def fake_cmd(deployments_by_context):
+    """
+    Fake of Vindaloo.cmd, clusters are queried in parallel so responses are picked by kubectl context
+    """
+    def cmd(command, *args, **kwargs):
+        res = mock.Mock()
+        res.returncode = 0
+        if command[:2] == ['git', 'rev-parse']:
+            res.stdout = b'd6ee34ae'
+        elif command == ['kubectl', 'config', 'get-contexts', '-o', 'name']:
+            res.stdout = '\n'.join(['other'] + list(deployments_by_context)).encode('utf-8')
+        elif command[1] == '--context':
+            response = deployments_by_context[command[2]]
+            if isinstance(response, Exception):
+                raise response
+            res.stdout = response
+        return res
+    return cmd
+
+
+def with_envs_config(loo, **attrs):
+    """
+    Overrides variables of vindaloo_conf.py loaded by `loo`, shared config module is left untouched
+    """
+    import_envs_config = loo._import_envs_config
+
+    def _import_envs_config():
+        import_envs_config()
+        loo.envs_config_module = types.SimpleNamespace(**dict(vars(loo.envs_config_module), **attrs))
+    loo._import_envs_config = _import_envs_config
+
+
+def with_label_selector(loo, selector):
+    with_envs_config(loo, VERSIONS_LABEL_SELECTOR=selector)
+
+
+def kubectl_get_deployments(context):
+    return [
+        'kubectl',
+        '--context',
+        context,
+        '--namespace',
+        'foo-dev',
+        'get',
+        'deployments,cronjobs,jobs',
+        '-o',
+        'json',
+    ]
 
 
 def test_versions_match(capsys):
     # fake arguments
     sys.argv = ['vindaloo', 'versions']
 
-    calls = [mock.Mock() for _ in range(6)]
-    for call in calls:
-        call.returncode = 0
-    calls[0].stdout = b'd6ee34ae'
-    calls[3].stdout = b'foo-registry.com/test/foo:d6ee34ae-dev foo-registry.com/test/bar:2.0.0'  # cluster1
-    calls[5].stdout = b'foo-registry.com/test/foo:d6ee34ae-dev foo-registry.com/test/bar:2.0.0'  # cluster2
-
     loo = Vindaloo()
     loo.cmd = mock.Mock()
-    loo.cmd.side_effect = calls
+    loo.cmd.side_effect = fake_cmd({
+        'foo-dev:cluster1': deployments_json(
+            foobar='foo-registry.com/test/foo:d6ee34ae-dev foo-registry.com/test/bar:2.0.0'
+        ),
+        'foo-dev:cluster2': deployments_json(
+            foobar='foo-registry.com/test/foo:d6ee34ae-dev foo-registry.com/test/bar:2.0.0'
+        ),
+    })
 
     with chdir('tests/test_roots/simple'):
         loo.main()
 
     # check the arguments kubectl was called with
-    assert len(loo.cmd.call_args_list) == 6
+    commands = [call[0][0] for call in loo.cmd.call_args_list]
+    assert len(commands) == 4
 
-    assert loo.cmd.call_args_list[0][0][0] == [
+    assert commands[0] == [
         'git',
         'rev-parse',
         '--short=8',
         'HEAD'
     ]
-    assert loo.cmd.call_args_list[1][0][0] == [
-        'kubectl',
-        'auth',
-        'can-i',
-        'get',
-        'deployment'
-    ]
-    assert loo.cmd.call_args_list[2][0][0][:3] == [
-        'kubectl',
-        'config',
-        'use-context',
-    ]
-    assert loo.cmd.call_args_list[2][0][0][3] == 'foo-dev:cluster1'
-    assert loo.cmd.call_args_list[3][0][0] == [
-        'kubectl',
-        'get',
-        'deployment',
-        'foobar',
-        '-o=jsonpath=\'{$.spec.template.spec.containers[*].image}\''
-    ]
-    assert loo.cmd.call_args_list[4][0][0][:3] == [
+    # contexts are listed once before clusters are queried in parallel
+    assert commands[1] == [
         'kubectl',
         'config',
-        'use-context',
-    ]
-    assert loo.cmd.call_args_list[4][0][0][3] == 'foo-dev:cluster2'
-    assert loo.cmd.call_args_list[5][0][0] == [
-        'kubectl',
-        'get',
-        'deployment',
-        'foobar',
-        '-o=jsonpath=\'{$.spec.template.spec.containers[*].image}\''
+        'get-contexts',
+        '-o',
+        'name',
     ]
+    assert kubectl_get_deployments('foo-dev:cluster1') in commands[2:]
+    assert kubectl_get_deployments('foo-dev:cluster2') in commands[2:]
 
     output = capsys.readouterr().out.strip()
 
@@ -78,67 +133,25 @@ def test_versions_not_match(capsys):
     # fake arguments
     sys.argv = ['vindaloo', 'versions']
 
-    def x(*args, **kwargs):
-        z = mock.Mock()
-        z.returncode = 0
-        return z
-
-    calls = [mock.Mock() for _ in range(6)]
-    for call in calls:
-        call.returncode = 0
-    calls[0].stdout = b'd6ee34ae'
-    calls[3].stdout = b'foo-registry.com/test/foo:d6ee34ae-dev foo-registry.com/test/bar:2.0.0'  # cluster1
-    calls[5].stdout = b'foo-registry.com/test/foo:0.0.9 foo-registry.com/test/bar:2.0.0'  # cluster2 DIFFERS
-
     loo = Vindaloo()
     loo.cmd = mock.Mock()
-    loo.cmd.side_effect = calls
+    loo.cmd.side_effect = fake_cmd({
+        'foo-dev:cluster1': deployments_json(
+            foobar='foo-registry.com/test/foo:d6ee34ae-dev foo-registry.com/test/bar:2.0.0'
+        ),
+        'foo-dev:cluster2': deployments_json(
+            foobar='foo-registry.com/test/foo:0.0.9 foo-registry.com/test/bar:2.0.0'  # DIFFERS
+        ),
+    })
 
     with chdir('tests/test_roots/simple'):
         loo.main()
 
     # check the arguments kubectl was called with
-    assert len(loo.cmd.call_args_list) == 6
-
-    assert loo.cmd.call_args_list[0][0][0] == [
-        'git',
-        'rev-parse',
-        '--short=8',
-        'HEAD'
-    ]
-    assert loo.cmd.call_args_list[1][0][0] == [
-        'kubectl',
-        'auth',
-        'can-i',
-        'get',
-        'deployment'
-    ]
-    assert loo.cmd.call_args_list[2][0][0][:3] == [
-        'kubectl',
-        'config',
-        'use-context',
-    ]
-    assert loo.cmd.call_args_list[2][0][0][3] == 'foo-dev:cluster1'
-    assert loo.cmd.call_args_list[3][0][0] == [
-        'kubectl',
-        'get',
-        'deployment',
-        'foobar',
-        '-o=jsonpath=\'{$.spec.template.spec.containers[*].image}\''
-    ]
-    assert loo.cmd.call_args_list[4][0][0][:3] == [
-        'kubectl',
-        'config',
-        'use-context',
-    ]
-    assert loo.cmd.call_args_list[4][0][0][3] == 'foo-dev:cluster2'
-    assert loo.cmd.call_args_list[5][0][0] == [
-        'kubectl',
-        'get',
-        'deployment',
-        'foobar',
-        '-o=jsonpath=\'{$.spec.template.spec.containers[*].image}\''
-    ]
+    commands = [call[0][0] for call in loo.cmd.call_args_list]
+    assert len(commands) == 4
+    assert kubectl_get_deployments('foo-dev:cluster1') in commands[2:]
+    assert kubectl_get_deployments('foo-dev:cluster2') in commands[2:]
 
     output = capsys.readouterr().out.strip()
 
@@ -151,27 +164,22 @@ def test_versions_json(capsys):
     # fake arguments
     sys.argv = ['vindaloo', 'versions', '--json']
 
-    def x(*args, **kwargs):
-        z = mock.Mock()
-        z.returncode = 0
-        return z
-
-    calls = [mock.Mock() for _ in range(6)]
-    for call in calls:
-        call.returncode = 0
-    calls[0].stdout = b'd6ee34ae'
-    calls[3].stdout = b'foo-registry.com/test/foo:1.0.0 foo-registry.com/test/bar:2.0.0'  # c1
-    calls[5].stdout = b'foo-registry.com/test/foo:0.0.9 foo-registry.com/test/bar:2.0.0'  # c2 DIFFERS
-
     loo = Vindaloo()
     loo.cmd = mock.Mock()
-    loo.cmd.side_effect = calls
+    loo.cmd.side_effect = fake_cmd({
+        'foo-dev:cluster1': deployments_json(
+            foobar='foo-registry.com/test/foo:1.0.0 foo-registry.com/test/bar:2.0.0'
+        ),
+        'foo-dev:cluster2': deployments_json(
+            foobar='foo-registry.com/test/foo:0.0.9 foo-registry.com/test/bar:2.0.0'  # DIFFERS
+        ),
+    })
 
     with chdir('tests/test_roots/simple'):
         loo.main()
 
     # check the arguments kubectl was called with
-    assert len(loo.cmd.call_args_list) == 6
+    assert len(loo.cmd.call_args_list) == 4
 
     output = capsys.readouterr().out.strip()
     data = json.loads(output)
@@ -182,3 +190,458 @@ def test_versions_json(capsys):
     assert data['dev']['test/bar']['remote']['cluster1'] == '2.0.0'
     assert data['dev']['test/foo']['remote']['cluster1'] == '1.0.0'
     assert data['dev']['test/foo']['remote']['cluster2'] == '0.0.9'
+
+
+def test_versions_all_workload_kinds(capsys):
+    # fake arguments
+    sys.argv = ['vindaloo', 'versions', '--json', 'dev']
+
+    loo = Vindaloo()
+    loo.cmd = mock.Mock()
+    loo.cmd.side_effect = fake_cmd({
+        'foo-dev:cluster1': deployments_json(
+            foo='foo-registry.com/test/foo:1.0.0',
+            cronjobs={
+                'foo': 'registry.hub.docker.com/library/busybox:latest',
+                'not-configured': 'foo-registry.com/test/other:1.0.0',
+            },
+        ),
+        'foo-dev:cluster2': deployments_json(foo='foo-registry.com/test/foo:0.9.0'),
+    })
+
+    with chdir('tests/test_roots/obj-config'):
+        loo.main()
+
+    # one list request per cluster for all kinds
+    assert [call[0][0][5:] for call in loo.cmd.call_args_list if call[0][0][1] == '--context'] == [
+        ['get', 'deployments,cronjobs,jobs', '-o', 'json'],
+        ['get', 'deployments,cronjobs,jobs', '-o', 'json'],
+    ]
+
+    data = json.loads(capsys.readouterr().out)
+    assert data['dev']['test/foo']['remote'] == {'cluster1': '1.0.0', 'cluster2': '0.9.0'}
+    assert data['dev']['registry.hub.docker.com/library/busybox']['remote'] == {'cluster1': 'latest'}
+    assert 'test/other' not in data['dev']
+
+
+def test_versions_one_query_per_cluster(capsys):
+    # fake arguments
+    sys.argv = ['vindaloo', 'versions', '--json']
+
+    def all_namespaces(command, *args, **kwargs):
+        res = mock.Mock()
+        res.returncode = 0
+        if command[1] == '--context':
+            res.stdout = json.dumps({'items': [
+                {
+                    'kind': 'Deployment',
+                    'metadata': {'name': 'foo', 'namespace': namespace},
+                    'spec': {'template': pod_spec('foo-registry.com/test/foo:{}'.format(version))},
+                }
+                for namespace, version in [('foo-dev', '1.0.0'), ('foo-test', '0.9.0'), ('other', '0.1.0')]
+            ]}).encode('utf-8')
+        return res
+
+    loo = Vindaloo()
+    loo.cmd = mock.Mock()
+    loo.cmd.side_effect = all_namespaces
+    with_label_selector(loo, 'app=foo')
+
+    with chdir('tests/test_roots/multi-env'):
+        loo.main()
+
+    # dev and test share both clusters, so each cluster is asked once
+    assert sorted(call[0][0] for call in loo.cmd.call_args_list if call[0][0][1] == '--context') == [
+        [
+            'kubectl', '--context', 'foo-dev:cluster1', 'get', 'deployments,cronjobs,jobs',
+            '--all-namespaces', '--selector', 'app=foo', '-o', 'json',
+        ],
+        [
+            'kubectl', '--context', 'foo-dev:cluster2', 'get', 'deployments,cronjobs,jobs',
+            '--all-namespaces', '--selector', 'app=foo', '-o', 'json',
+        ],
+    ]
+
+    data = json.loads(capsys.readouterr().out)
+    assert data['dev']['test/foo']['remote'] == {'cluster1': '1.0.0', 'cluster2': '1.0.0'}
+    assert data['test']['test/foo']['remote'] == {'cluster1': '0.9.0', 'cluster2': '0.9.0'}
+
+
+def test_versions_one_query_per_aliased_cluster(capsys):
+    # fake arguments
+    sys.argv = ['vindaloo', 'versions', '--json']
+
+    loo = Vindaloo()
+    loo.cmd = mock.Mock()
+    loo.cmd.side_effect = lambda command, *args, **kwargs: mock.Mock(returncode=0, stdout=json.dumps({'items': []}).encode())
+    envs = {
+        'dev': {'k8s_namespace': 'foo-dev', 'k8s_clusters': ['cluster1'], 'docker_registry': 'foo-registry.com'},
+        'test': {'k8s_namespace': 'foo-test', 'k8s_clusters': ['c1'], 'docker_registry': 'foo-registry.com'},
+    }
+    with_envs_config(loo, ENVS=envs, VERSIONS_LABEL_SELECTOR='app=foo')
+
+    with chdir('tests/test_roots/multi-env'):
+        loo.main()
+
+    # c1 is alias of cluster1, so both envs are read by one query
+    assert [call[0][0][:3] for call in loo.cmd.call_args_list if call[0][0][1] == '--context'] == [
+        ['kubectl', '--context', 'foo-dev:cluster1'],
+    ]
+
+
+def test_versions_namespace_fallback(capsys):
+    # fake arguments
+    sys.argv = ['vindaloo', 'versions', '--json']
+
+    def forbidden_across_namespaces(command, *args, **kwargs):
+        res = mock.Mock()
+        res.returncode = 0
+        if '--all-namespaces' in command:
+            res.returncode = 1
+            res.stdout = b''
+            res.stderr = b'Error from server (Forbidden): deployments.apps is forbidden'
+        elif command[1] == '--context':
+            res.stdout = deployments_json(foo='foo-registry.com/test/foo:1.0.0')
+        return res
+
+    loo = Vindaloo()
+    loo.cmd = mock.Mock()
+    loo.cmd.side_effect = forbidden_across_namespaces
+    with_label_selector(loo, 'app=foo')
+
+    with chdir('tests/test_roots/multi-env'):
+        loo.main()
+
+    namespaced = [call[0][0][4] for call in loo.cmd.call_args_list if call[0][0][3] == '--namespace']
+    assert sorted(namespaced) == ['foo-dev', 'foo-dev', 'foo-test', 'foo-test']
+
+    data = json.loads(capsys.readouterr().out)
+    assert data['test']['test/foo']['remote'] == {'cluster1': '1.0.0', 'cluster2': '1.0.0'}
+
+
+def test_versions_without_selector_per_namespace(capsys):
+    # fake arguments
+    sys.argv = ['vindaloo', 'versions', '--json']
+
+    loo = Vindaloo()
+    loo.cmd = mock.Mock()
+    loo.cmd.side_effect = lambda command, *args, **kwargs: mock.Mock(
+        returncode=0, stdout=deployments_json(foo='foo-registry.com/test/foo:1.0.0'),
+    )
+
+    with chdir('tests/test_roots/multi-env'):
+        loo.main()
+
+    # without VERSIONS_LABEL_SELECTOR the whole cluster is not listed, every namespace is asked separately
+    kubectl_calls = [call[0][0] for call in loo.cmd.call_args_list if call[0][0][1] == '--context']
+    assert not [command for command in kubectl_calls if '--all-namespaces' in command]
+    assert sorted(command[4] for command in kubectl_calls) == ['foo-dev', 'foo-dev', 'foo-test', 'foo-test']
+
+    data = json.loads(capsys.readouterr().out)
+    assert data['dev']['test/foo']['remote'] == {'cluster1': '1.0.0', 'cluster2': '1.0.0'}
+
+
+def test_versions_unreachable_cluster(capsys):
+    # fake arguments
+    sys.argv = ['vindaloo', 'versions', '--timeout', '5']
+
+    loo = Vindaloo()
+    loo.cmd = mock.Mock()
+    loo.cmd.side_effect = fake_cmd({
+        'foo-dev:cluster1': deployments_json(
+            foobar='foo-registry.com/test/foo:d6ee34ae-dev foo-registry.com/test/bar:2.0.0'
+        ),
+        'foo-dev:cluster2': subprocess.TimeoutExpired(kubectl_get_deployments('foo-dev:cluster2'), 5.0),
+    })
+
+    with chdir('tests/test_roots/simple'):
+        loo.main()
+
+    for call in loo.cmd.call_args_list:
+        if call[0][0][1] == '--context':
+            assert call[1]['timeout'] == 5
+
+    output = capsys.readouterr().out.strip()
+
+    # the unreachable cluster is reported, the other one is compared as usual
+    assert 'Cluster: cluster2 [ERROR] timed out after 5.0s' in output
+    assert '[DIFFERS]' not in output
+    assert "'cluster1': 'd6ee34ae-dev'" in output
+
+
+def test_versions_ndjson(capsys):
+    # fake arguments
+    sys.argv = ['vindaloo', 'versions', '--ndjson']
+
+    cluster1_printed = threading.Event()
+    cmd = fake_cmd({
+        'foo-dev:cluster1': deployments_json(
+            foobar='foo-registry.com/test/foo:d6ee34ae-dev foo-registry.com/test/bar:2.0.0 foo-registry.com/test/baz:1.0'
+        ),
+        'foo-dev:cluster2': subprocess.CalledProcessError(1, 'kubectl', b'', b'error: connection refused'),
+    })
+
+    def slow_cmd(command, *args, **kwargs):
+        if 'foo-dev:cluster2' in command and command[1] == '--context':
+            # cluster2 answers only after cluster1 was streamed
+            assert cluster1_printed.wait(5)
+        return cmd(command, *args, **kwargs)
+
+    loo = Vindaloo()
+    loo.cmd = mock.Mock()
+    loo.cmd.side_effect = slow_cmd
+    print_record = loo._print_versions_record
+
+    def print_and_notify(local_, env, cluster, *args):
+        print_record(local_, env, cluster, *args)
+        if cluster == 'cluster1':
+            cluster1_printed.set()
+
+    loo._print_versions_record = print_and_notify
+
+    with chdir('tests/test_roots/simple'):
+        loo.main()
+
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert records == [
+        {'env': 'dev', 'cluster': 'cluster1', 'image': 'test/foo', 'local': 'd6ee34ae-dev',
+         'remote': 'd6ee34ae-dev', 'remote_age': 0},
+        {'env': 'dev', 'cluster': 'cluster1', 'image': 'test/bar', 'local': '2.0.0', 'remote': '2.0.0', 'remote_age': 0},
+        {'env': 'dev', 'cluster': 'cluster1', 'image': 'test/baz', 'local': None, 'remote': '1.0', 'remote_age': 0},
+        {'env': 'dev', 'cluster': 'cluster2', 'error': 'error: connection refused'},
+    ]
+
+
+def test_versions_watch(capsys):
+    # fake arguments
+    sys.argv = ['vindaloo', 'versions', '--watch']
+
+    streams = {
+        'foo-dev:cluster1': (
+            b'ADDED\tDeployment\tfoobar\tfoo=foo-registry.com/test/foo:0.0.9 bar=foo-registry.com/test/bar:2.0.0 \n'
+            b'ADDED\tDeployment\tother\tother=foo-registry.com/test/other:1.0.0 \n'
+            b'MODIFIED\tDeployment\tfoobar\tfoo=foo-registry.com/test/foo:d6ee34ae-dev bar=foo-registry.com/test/bar:2.0.0 \n'
+        ),
+        'foo-dev:cluster2': (
+            b'ADDED\tDeployment\tfoobar\tfoo=foo-registry.com/test/foo:d6ee34ae-dev bar=foo-registry.com/test/bar:2.0.0 \n'
+        ),
+    }
+
+    def spawn(command, stdout=None):
+        process = mock.Mock()
+        process.stdout = io.BytesIO(streams[command[2]])
+        return process
+
+    loo = Vindaloo()
+    loo.cmd = mock.Mock()
+    loo.cmd.side_effect = fake_cmd({})
+    loo.spawn = mock.Mock()
+    loo.spawn.side_effect = spawn
+    print_summary = loo._print_versions_summary
+    tables = []
+
+    def print_until_converged(summary, errors, ages):
+        print_summary(summary, errors, ages)
+        tables.append(summary)
+        if summary['dev']['test/foo']['remote'] == {'cluster1': 'd6ee34ae-dev', 'cluster2': 'd6ee34ae-dev'}:
+            raise KeyboardInterrupt
+
+    loo._print_versions_summary = print_until_converged
+
+    with chdir('tests/test_roots/simple'):
+        loo.main()
+
+    # one watch per cluster, no polling
+    assert {call[0][0][2] for call in loo.spawn.call_args_list} == {'foo-dev:cluster1', 'foo-dev:cluster2'}
+    assert loo.spawn.call_args_list[0][0][0][5:11] == [
+        'get', 'deployments', '--watch', '--output-watch-events', '-o', 'jsonpath={}'.format(VERSIONS_WATCH_JSONPATH),
+    ]
+    assert [call[0][0][:2] for call in loo.cmd.call_args_list if call[0][0][1] == '--context'] == []
+
+    # deployments which are not configured are ignored
+    assert 'test/other' not in tables[-1]['dev']
+    assert '[DIFFERS]' not in capsys.readouterr().out.split('Image and version')[-1]
+
+
+@pytest.mark.parametrize('kinds_at_once', [True, False])
+def test_versions_watch_kinds(capsys, kinds_at_once):
+    # fake arguments
+    sys.argv = ['vindaloo', 'versions', '--watch', 'dev']
+
+    events = {
+        'deployments': b'ADDED\tDeployment\tfoo\tfoo=foo-registry.com/test/foo:1.0.0 \n',
+        'cronjobs': b'ADDED\tCronJob\tfoo\tfoo=foo-registry.com/test/foo:1.0.0 \n',
+        'jobs': b'ADDED\tJob\tfoo\tfoo=foo-registry.com/test/foo:1.0.0 \n',
+    }
+
+    def spawn(command, stdout=None):
+        process = mock.Mock()
+        if command[6] == 'deployments,cronjobs,jobs':
+            process.stdout = io.BytesIO(b''.join(events.values()) if kinds_at_once else (
+                b'error: watch is only supported on individual resources and resource collections, '
+                b'but 3 resources were found\n'
+            ))
+        else:
+            process.stdout = io.BytesIO(events[command[6]])
+        return process
+
+    loo = Vindaloo()
+    loo.cmd = mock.Mock()
+    loo.cmd.side_effect = fake_cmd({})
+    loo.spawn = mock.Mock()
+    loo.spawn.side_effect = spawn
+    watched = set()
+
+    def print_until_converged(summary, errors, ages):
+        remote = summary['dev']['test/foo']['remote']
+        if remote.get('cluster1') == '1.0.0' and remote.get('cluster2') == '1.0.0':
+            watched.update((call[0][0][2], call[0][0][6]) for call in loo.spawn.call_args_list)
+            raise KeyboardInterrupt
+
+    loo._print_versions_summary = print_until_converged
+
+    with chdir('tests/test_roots/obj-config'):
+        loo.main()
+
+    # one watch of all configured kinds per context, one per kind when kubectl can't do that
+    grouped = {(context, 'deployments,cronjobs,jobs') for context in ('foo-dev:cluster1', 'foo-dev:cluster2')}
+    if kinds_at_once:
+        assert watched == grouped
+    else:
+        assert grouped <= watched
+        assert ('foo-dev:cluster1', 'deployments') in watched
+        assert {kind for _, kind in watched - grouped} <= {'deployments', 'cronjobs', 'jobs'}
+
+
+def test_versions_watch_nothing(capsys, test_temp_dir):
+    project_dir = os.path.join(test_temp_dir, 'project')
+    os.makedirs(os.path.join(project_dir, 'k8s'))
+    shutil.copy('tests/vindaloo_conf.py', test_temp_dir)
+    with open(os.path.join(project_dir, 'k8s', 'versions.json'), 'w') as fp:
+        fp.write('{}')
+    for env in ('base', 'dev'):
+        with open(os.path.join(project_dir, 'k8s', '{}.py'.format(env)), 'w') as fp:
+            fp.write('K8S_OBJECTS = {}\nDOCKER_FILES = []\n')
+
+    # fake arguments
+    sys.argv = ['vindaloo', 'versions', '--watch']
+    loo = Vindaloo()
+    loo.cmd = mock.Mock()
+    loo.cmd.side_effect = fake_cmd({})
+    loo.spawn = mock.Mock()
+
+    with chdir(project_dir):
+        loo.main()
+
+    assert not loo.spawn.called
+    assert 'Nothing to watch' in capsys.readouterr().out
+
+
+def run_versions(*args):
+    sys.argv = ['vindaloo', 'versions'] + list(args)
+
+    loo = Vindaloo()
+    loo.cmd = mock.Mock()
+    loo.cmd.side_effect = fake_cmd({
+        'foo-dev:cluster1': deployments_json(
+            foobar='foo-registry.com/test/foo:d6ee34ae-dev foo-registry.com/test/bar:2.0.0'
+        ),
+        'foo-dev:cluster2': deployments_json(
+            foobar='foo-registry.com/test/foo:d6ee34ae-dev foo-registry.com/test/bar:2.0.0'
+        ),
+    })
+    with chdir('tests/test_roots/simple'):
+        loo.main()
+    return [call[0][0] for call in loo.cmd.call_args_list if call[0][0][0] == 'kubectl']
+
+
+def test_versions_cached(capsys):
+    assert len(run_versions()) == 3
+    assert 'Cluster: cluster1 fresh' in capsys.readouterr().out
+
+    # second run is served from the cache, contexts are not even checked
+    assert run_versions() == []
+    output = capsys.readouterr().out
+    assert 'Cluster: cluster1 cached' in output
+    assert 'Cluster: cluster2 cached' in output
+    assert '[DIFFERS]' not in output
+
+    assert len(run_versions('--refresh')) == 3
+    assert 'Cluster: cluster1 fresh' in capsys.readouterr().out
+
+    run_versions('--json')
+    data = json.loads(capsys.readouterr().out)
+    assert data['dev']['test/foo']['remote_age'].keys() == {'cluster1', 'cluster2'}
+
+
+def test_versions_cache_invalidated_by_deploy(loo, capsys):
+    run_versions()
+
+    sys.argv = ['vindaloo', '--noninteractive', 'deploy', 'dev', 'cluster1']
+    with chdir('tests/test_roots/simple'):
+        loo.main()
+
+    # only the cluster vindaloo deployed to is queried again
+    assert run_versions() == [
+        ['kubectl', 'config', 'get-contexts', '-o', 'name'], kubectl_get_deployments('foo-dev:cluster1'),
+    ]
+    output = capsys.readouterr().out
+    assert 'Cluster: cluster1 fresh' in output
+    assert 'Cluster: cluster2 cached' in output
+
+
+def test_images_inventory(loo):
+    loo.args = mock.Mock()
+    loo.args.command = 'versions'
+    loo.args.dryrun = False
+    res = mock.Mock()
+    res.returncode = 0
+    res.stdout = deployments_json(
+        foobar='test/foo:1.0.0 test/bar:2.0.0', other='test/other:3.0.0', cronjobs={'robot': 'test/robot:4.0.0'}
+    )
+    loo.cmd.return_value = res
+
+    inventory = loo.get_k8s_images_inventory(['kubectl', '--context', 'foo-dev:cluster1', '--namespace', 'foo-dev'])
+
+    assert inventory == {
+        ('deployment', 'foobar', 'c0'): 'test/foo:1.0.0',
+        ('deployment', 'foobar', 'c1'): 'test/bar:2.0.0',
+        ('deployment', 'other', 'c0'): 'test/other:3.0.0',
+        ('cronjob', 'robot', 'c0'): 'test/robot:4.0.0',
+    }
+    assert loo.cmd.call_count == 1
+
+
+def test_versions_config_snapshot(capsys, test_temp_dir):
+    project_dir = os.path.join(test_temp_dir, 'project')
+    shutil.copytree('tests/test_roots/obj-config', project_dir)
+    shutil.copy('tests/vindaloo_conf.py', test_temp_dir)
+    with open(os.path.join(test_temp_dir, 'vindaloo_conf.py'), 'a') as fp:
+        fp.write('\nCONFIG_SNAPSHOTS = True\n')
+
+    def run():
+        sys.argv = ['vindaloo', '--timings-json', 'versions', '--json', 'dev']
+        loo = Vindaloo()
+        loo.cmd = mock.Mock()
+        loo.cmd.side_effect = fake_cmd({
+            'foo-dev:cluster1': deployments_json(foo='foo-registry.com/test/foo:1.0.0'),
+            'foo-dev:cluster2': deployments_json(foo='foo-registry.com/test/foo:0.9.0'),
+        })
+        with chdir(project_dir):
+            loo.main()
+        captured = capsys.readouterr()
+        return json.loads(captured.out), json.loads(captured.err)['phases']
+
+    versions, phases = run()
+    assert phases['env config import']['calls'] == 2
+    assert versions['dev']['test/foo']['local'] == '1.0.0'
+
+    # nothing changed, configs are not evaluated
+    assert run() == (versions, {key: mock.ANY for key in phases if key != 'env config import'})
+
+    # changed file of k8s dir invalidates snapshots
+    with open(os.path.join(project_dir, 'k8s', 'versions.json'), 'w') as fp:
+        json.dump({'test/foo': '1.10.0'}, fp)
+    versions, phases = run()
+    assert phases['env config import']['calls'] == 2
+    assert versions['dev']['test/foo']['local'] == '1.10.0'
@@ -80,6 +80,10 @@ class Dict(JsonSerializable):
     def __deepcopy__(self, memo):
         return self.__class__(copy.deepcopy(self.children, memo))
 
+    def __reduce__(self):
+        # __getattr__ would create children for attributes which pickle looks up (e.g. __setstate__)
+        return self.__class__, (self.children,)
+
     def __str__(self):
         return f'<Dict {self.children}>'
 
@@ -486,10 +490,7 @@ class ConfigMap(KubernetesManifestMixin):
             with open(f'k8s/{filename}', 'br') as file:
                 return self._binary_value_prep(file.read())
         else:
-            temp_file = app.create_file(filename, config, no_edit=True)
-            file_content = temp_file.read()
-            temp_file.close()
-            return file_content.decode('utf-8')
+            return app.render_template(filename, config)
 
     def prepare_data(self, data: DictType[str, Any], app, is_binary: bool = False) -> DictType[str, str]:
         new_data = {}
@@ -1,3 +1,9 @@
+import builtins
+from importlib.machinery import FileFinder, SourceFileLoader, SOURCE_SUFFIXES
+from importlib.util import module_from_spec
+import os
+import sys
+import types
 
 
 class NamespaceWithDefaultValue:
@@ -12,3 +18,187 @@ class NamespaceWithDefaultValue:
         if hasattr(self.namespace, name):
             return getattr(self.namespace, name)
         return self.default_value
+
+
+def _read_first_line(path):
+    with open(path, 'r') as fp:
+        return fp.readline().strip()
+
+
+def _is_hex_hash(value):
+    return len(value) in (40, 64) and all(char in '0123456789abcdef' for char in value)
+
+
+def _resolve_git_ref(ref, git_dir, common_dir, depth=0):
+    """
+    Returns hash the ref points to, reads loose refs and packed-refs.
+    """
+    if depth > 5:
+        return None
+
+    for base_dir in (git_dir, common_dir):
+        try:
+            value = _read_first_line(os.path.join(base_dir, ref))
+        except OSError:
+            continue
+        if value.startswith('ref: '):
+            return _resolve_git_ref(value[5:], git_dir, common_dir, depth + 1)
+        return value if _is_hex_hash(value) else None
+
+    try:
+        with open(os.path.join(common_dir, 'packed-refs'), 'r') as fp:
+            for line in fp:
+                if line.startswith(('#', '^')):
+                    continue
+                parts = line.split()
+                if len(parts) == 2 and parts[1] == ref:
+                    return parts[0] if _is_hex_hash(parts[0]) else None
+    except OSError:
+        pass
+    return None
+
+
+def git_head_commit(path):
+    """
+    Returns hash of HEAD commit of git repository containing `path` without running git.
+
+    Handles `.git` directories, `.git` files of worktrees and submodules (gitdir, commondir),
+    loose refs and packed-refs. Returns None for anything else (e.g. reftable), so the caller
+    can ask git binary.
+    """
+    if os.getenv('GIT_DIR'):
+        return None
+
+    directory = os.path.abspath(path)
+    while True:
+        dot_git = os.path.join(directory, '.git')
+        if os.path.exists(dot_git):
+            break
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+    try:
+        if os.path.isfile(dot_git):
+            gitdir = _read_first_line(dot_git)
+            if not gitdir.startswith('gitdir: '):
+                return None
+            git_dir = os.path.join(directory, gitdir[8:])
+        else:
+            git_dir = dot_git
+
+        common_dir = git_dir
+        if os.path.isfile(os.path.join(git_dir, 'commondir')):
+            common_dir = os.path.join(git_dir, _read_first_line(os.path.join(git_dir, 'commondir')))
+
+        if os.path.exists(os.path.join(common_dir, 'reftable')):
+            return None
+
+        head = _read_first_line(os.path.join(git_dir, 'HEAD'))
+    except OSError:
+        return None
+
+    if head.startswith('ref: '):
+        return _resolve_git_ref(head[5:], git_dir, common_dir)
+    return head if _is_hex_hash(head) else None
+
+
+class _PackageProxy(types.ModuleType):
+    """
+    Package as seen by one config evaluation, with its own `app`
+    """
+    def __init__(self, package, app):
+        super().__init__(package.__name__, package.__doc__)
+        self._package = package
+        self.app = app
+
+    def __getattr__(self, name):
+        return getattr(self._package, name)
+
+
+class ConfigLoader:
+    """
+    Evaluates python modules of the config directory in an isolated namespace.
+
+    Modules of the directory are neither looked up in nor registered to `sys.modules`, every loader has
+    its own instances of them (so `from base import *` evaluates base.py for each env again) and `import vindaloo`
+    gives the package with the loader's own `app`. `sys.path` and other global state are left untouched,
+    so several loaders can evaluate configs concurrently in threads.
+    """
+    def __init__(self, config_dir, app, package='vindaloo'):
+        self.config_dir = os.path.abspath(config_dir)
+        self.package = package
+        self.package_proxy = _PackageProxy(sys.modules[package], app)
+        self.modules = {}
+        self.builtins = dict(vars(builtins), __import__=self._import)
+
+    def load(self, name):
+        """
+        Returns evaluated module `name` of the config directory, None if there is no such module.
+        """
+        if name in self.modules:
+            return self.modules[name]
+
+        parent_name, _, child_name = name.rpartition('.')
+        if parent_name:
+            parent = self.load(parent_name)
+            search_path = getattr(parent, '__path__', None)
+            if not search_path:
+                return None
+        else:
+            search_path = [self.config_dir]
+
+        spec = None
+        for directory in search_path:
+            finder = FileFinder(directory, (SourceFileLoader, SOURCE_SUFFIXES))
+            spec = finder.find_spec(name)
+            if spec is not None and spec.loader is not None:
+                break
+        if spec is None or spec.loader is None:
+            return None
+
+        module = module_from_spec(spec)
+        module.__builtins__ = self.builtins  # imports of the module go through the loader too
+        self.modules[name] = module
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            del self.modules[name]
+            raise
+        if parent_name:
+            setattr(parent, child_name, module)
+        return module
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level:
+            package = (globals or {}).get('__package__')
+            if package not in self.modules:
+                return builtins.__import__(name, globals, locals, fromlist, level)
+            # relative import within package of the config dir, resolved to absolute name of the loader's module
+            base = package.rsplit('.', level - 1)
+            if len(base) < level:
+                raise ImportError('attempted relative import beyond top-level package')
+            name = '{}.{}'.format(base[0], name) if name else base[0]
+            level = 0
+
+        top_name = name.partition('.')[0]
+        if top_name == self.package:
+            module = builtins.__import__(name, globals, locals, fromlist, level)
+            if fromlist and name != self.package:
+                return module
+            return self.package_proxy
+
+        if self.load(top_name) is None:
+            return builtins.__import__(name, globals, locals, fromlist, level)
+
+        module = self.load(name)
+        if module is None:
+            raise ModuleNotFoundError('No module named {!r}'.format(name), name=name)
+        if not fromlist:
+            return self.modules[top_name]
+        if hasattr(module, '__path__'):
+            for item in fromlist:
+                if item != '*' and not hasattr(module, item):
+                    self.load('{}.{}'.format(name, item))
+        return module
@@ -2,36 +2,26 @@
 
 import argparse
 import base64
-import imp
-import shutil
-from importlib import import_module
+import functools
+from importlib.machinery import SourceFileLoader
+from importlib.util import module_from_spec, spec_from_loader
 import json
 import os
-import ssl
-import subprocess
 import sys
-import tempfile
+import threading
 import time
-from typing import Any, Dict, List, Set, BinaryIO, Sequence
-import urllib.request
-
-import argcomplete
-import chevron
-
-from .convert import get_obj_repr_from_dict
-from .examples import (
-    EXAMPLE_VINDALOO_CONF,
-    EXAMPLE_BASE,
-    EXAMPLE_DEV,
-    EXAMPLE_DOCKERFILE,
-    EXAMPLE_DEPLOYMENT,
-    EXAMPLE_SERVICE,
-)
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Set, BinaryIO, Sequence, Tuple
+
+# argcomplete, chevron, hashlib, ssl, subprocess, tempfile, urllib and concurrent.futures are imported
+# in methods which need them, so `version` and tab completion start fast
+if TYPE_CHECKING:
+    import subprocess  # noqa: F401, only for annotations
+
 from .objects import JsonSerializable
-from .utils import NamespaceWithDefaultValue
+from .utils import ConfigLoader, NamespaceWithDefaultValue, git_head_commit
 
 DO_NOT_NEED_CONFIG_FILE = ('init', 'completion', 'version')
-DO_NOT_NEED_K8S_DIR = ('edit-secret',)
+DO_NOT_NEED_K8S_DIR = ('edit-secret', 'apply-bundle')  # apply-bundle runs on deploy hosts without sources
 
 NONE = "base"
 K8S_OBJECT_TYPES = [
@@ -58,12 +48,47 @@ K8S_OBJECT_TYPES_YAML_PREFIX = {
     "servicemonitor": "9",
     "podmonitor": "10",
 }
+DEFAULT_DEPLOY_WORKERS = 4  # clusters deployed at once
+DEFAULT_APPLY_WORKERS = 4
+DEFAULT_VERSIONS_WORKERS = 8
+DEFAULT_VERSIONS_TIMEOUT = 30  # seconds for one env/cluster
+DEFAULT_VERSIONS_CACHE_TTL = 60
+VERSIONS_CACHE_DIR = 'versions'
+VERSIONS_WATCH_RECONNECT = 5  # seconds before dropped watch of deployments is opened again
+# event type, kind, name and containers of watched workload (pod spec of cronjob is nested in jobTemplate)
+VERSIONS_WATCH_JSONPATH = (
+    '{.type}{"\\t"}{.object.kind}{"\\t"}{.object.metadata.name}{"\\t"}'
+    '{range .object.spec.template.spec.containers[*]}{.name}={.image} {end}'
+    '{range .object.spec.jobTemplate.spec.template.spec.containers[*]}{.name}={.image} {end}{"\\n"}'
+)
+VERSIONS_OBJECT_TYPES = ('deployment', 'cronjob', 'job')  # workloads whose images `versions` compares
+CONFIG_SNAPSHOTS_DIR = 'configs'
+BUNDLE_INDEX = 'index.json'
+BUNDLE_OBJECTS_DIR = 'objects'  # manifests named by sha256 of their content
+DEFAULT_PROGRESS_DEADLINE = 600  # kubernetes default of progressDeadlineSeconds
+ROLLOUT_POLL_INTERVAL = 1
+JOB_WATCH_MIN_BACKOFF = 1
+JOB_WATCH_MAX_BACKOFF = 60
+JOB_WATCH_MAX_RETRIES = 10
 SUCCESS_REPLY = ("Y", "y", "a", "A")
 ENVS_CONFIG_NAME = 'vindaloo_conf'
-NEEDS_K8S_LOGIN = ('versions', 'deploy', 'build-push-deploy', 'edit-secret')
+NEEDS_K8S_LOGIN = ('versions', 'deploy', 'build-push-deploy', 'edit-secret', 'apply-bundle')
+CHECK_K8S_LOGIN_FIRST = ('build-push-deploy',)  # login is checked before long running build
+DEFAULT_K8S_LOGIN_CACHE_TTL = 300
+K8S_LOGINS_CACHE_FILE = 'k8s_logins.json'
 CONFIG_DIR = 'k8s'
 GIT_HASH_PLACEHOLDER = '{{git}}'
+DIGEST_ANNOTATION = 'vindaloo.seznam.cz/digest'
+LIVE_DIGESTS_JSONPATH = (
+    '{range .items[*]}{.kind}{"\\t"}{.metadata.name}{"\\t"}'
+    '{.metadata.annotations.vindaloo\\.seznam\\.cz/digest}{"\\n"}{end}'
+)
+CACHE_DIR_ENV = 'VINDALOO_CACHE_DIR'
 CHECK_VERSION_URL = 'https://raw.githubusercontent.com/seznam/vindaloo/master/version.json'
+CHECK_VERSION_ENV = 'VINDALOO_NO_VERSION_CHECK'
+CHECK_VERSION_INTERVAL = 24 * 3600  # latest version (or failure to get it) is remembered for a day
+CHECK_VERSION_CACHE_FILE = 'latest_version.json'
+ENVS_CONFIG_PATHS_FILE = 'envs_config_paths.json'  # cwd -> [path, mtime] of found vindaloo_conf.py
 
 VERSION = '4.5.0'
 
@@ -72,6 +97,22 @@ class RefreshException(Exception):
     pass
 
 
+def timed(phase: str) -> Callable:
+    """
+    Decorator measuring duration of method calls, reported by `--timings`.
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            start = time.monotonic()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                self._record_timing(phase, time.monotonic() - start)
+        return wrapper
+    return decorator
+
+
 class Vindaloo:
     """
     Tool which should make docker and k8s stuff easier.
@@ -83,17 +124,89 @@ class Vindaloo:
         self.args = None
         self.changed_secrets = {}  # Secrety naplanovane ke zmene
         self.versions = {}  # Verze imagu
-
-    def _am_i_logged_in(self) -> bool:
+        # (env, args.environment, args.cluster) -> konfigurace
+        self.config_modules = {}  # type: Dict[Tuple[str, Optional[str], Optional[str]], Any]
+        # (env, args.environment, args.cluster) -> DOCKER_FILES a K8S_OBJECTS
+        self.config_snapshots = {}  # type: Dict[Tuple[str, Optional[str], Optional[str]], Any]
+        self.git_hash = None  # type: Optional[str]
+        self.known_contexts = set()  # type: Set[str]  # K8S contexty, o kterych vime, ze existuji
+        self.k8s_contexts = None  # type: Optional[Set[str]]  # vsechny contexty z kubeconfigu, nactene jednou
+        self.verified_logins = set()  # type: Set[str]  # K8S contexty s overenym prihlasenim
+        self.lock = threading.Lock()  # zamek pro stav sdileny vlakny
+        self.timings = {}  # type: Dict[str, List[float]]  # faze -> [pocet volani, celkova doba]
+        self.latest_version = None  # type: Optional[str]  # nejnovejsi verze vindaloo, pokud ji zname
+        self.version_check = None  # type: Optional[threading.Thread]
+
+    def _am_i_logged_in(self, kubectl: List[str] = None) -> bool:
         """
         Checks k8s login.
         """
         spc = self.cmd(
-            ["kubectl", "auth", "can-i", "get", "deployment"],
+            (kubectl or ["kubectl"]) + ["auth", "can-i", "get", "deployment"],
             get_stdout=True,
         )
         return spc.returncode == 0
 
+    def kubectl_cmd(
+            self, kubectl: List[str], command: List[str], check_login: bool = True, **kwargs
+    ) -> 'subprocess.CompletedProcess':
+        """
+        Runs kubectl command, login check is merged into it.
+
+        Successful call proves the login, so it is remembered for K8S_LOGIN_CACHE_TTL seconds.
+        Only when the call fails and the login was not verified lately, `kubectl auth can-i` is asked
+        whether the failure was caused by missing login (unless `check_login` is False).
+        """
+        res = self.cmd(kubectl + command, **kwargs)
+        if self.args.command not in NEEDS_K8S_LOGIN or self.args.dryrun:
+            return res
+
+        if res.returncode == 0:
+            self._store_login_verified(kubectl)
+        elif check_login and not self._is_login_verified(kubectl) and not self._am_i_logged_in(kubectl):
+            self.fail("You are not logged in Kubernetes")
+        return res
+
+    @staticmethod
+    def _kubectl_context(kubectl: List[str]) -> str:
+        if '--context' in kubectl:
+            return kubectl[kubectl.index('--context') + 1]
+        return ''
+
+    def _load_verified_logins(self) -> Dict[str, float]:
+        try:
+            with open(os.path.join(self._cache_dir(), K8S_LOGINS_CACHE_FILE), 'r') as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return {}
+
+    def _is_login_verified(self, kubectl: List[str]) -> bool:
+        """
+        Returns whether login into context was verified within K8S_LOGIN_CACHE_TTL.
+        """
+        context = self._kubectl_context(kubectl)
+        if context in self.verified_logins:
+            return True
+
+        ttl = getattr(self.envs_config_module, 'K8S_LOGIN_CACHE_TTL', DEFAULT_K8S_LOGIN_CACHE_TTL)
+        verified_at = self._load_verified_logins().get(context)
+        if verified_at and time.time() - verified_at < ttl:
+            self.verified_logins.add(context)
+            return True
+        return False
+
+    def _store_login_verified(self, kubectl: List[str]) -> None:
+        context = self._kubectl_context(kubectl)
+        if context in self.verified_logins:
+            return
+
+        with self.lock:
+            self.verified_logins.add(context)
+            logins = self._load_verified_logins()
+            logins[context] = time.time()
+            with open(os.path.join(self._cache_dir(), K8S_LOGINS_CACHE_FILE), 'w') as fp:
+                json.dump(logins, fp)
+
     def _confirm(self, message: str, default: str = "y") -> bool:
         res = input("{}{}: ".format(message, " [{}]".format(default)) if default else "")
         if res in SUCCESS_REPLY or (not res and default in SUCCESS_REPLY):
@@ -119,6 +232,15 @@ class Vindaloo:
         """
         Initialize project for vindaloo.
         """
+        from .examples import (
+            EXAMPLE_VINDALOO_CONF,
+            EXAMPLE_BASE,
+            EXAMPLE_DEV,
+            EXAMPLE_DOCKERFILE,
+            EXAMPLE_DEPLOYMENT,
+            EXAMPLE_SERVICE,
+        )
+
         os.chdir(self.args.dir)
         if self._check_current_dir():
             self.fail("Project already contains `k8s` directory.")
@@ -187,6 +309,7 @@ class Vindaloo:
 
     def convert_manifest(self):
         import yaml
+        from .convert import get_obj_repr_from_dict
         with open(self.args.manifest, 'r') as fp:
             manifest_data = yaml.load(fp, Loader=yaml.Loader)
             res = get_obj_repr_from_dict(manifest_data)
@@ -210,78 +333,609 @@ class Vindaloo:
         if dep_env not in self.envs_config_module.ENVS:
             self.fail("Unknown environment '{}'.".format(dep_env))
 
+        clusters = self._get_deploy_clusters(dep_env)
+
         self.config_module = self._import_config(dep_env)
         if not self.config_module:
             self.fail(f"Environment '{dep_env}' does not have configuration.")
 
-        # prepneme se
+        if clusters:
+            self._k8s_deploy_to_clusters(dep_env, clusters)
+            return
+
+        kubectl = ["kubectl"]
         if not self.args.apply_output_dir:
-            self._select_k8s_context(dep_env, self.args.cluster)
+            self._ensure_k8s_context(dep_env, self.args.cluster)
+            kubectl = self._kubectl_base(dep_env, self.args.cluster)
+
+        manifests = self._render_k8s_objects()
+
+        failed_objects = self._apply_manifests(manifests, kubectl=kubectl)
+        if failed_objects:
+            self.fail("Vindaloo stopped working due to objects which failed to apply: {}".format(failed_objects))
+
+        if self.args.watch:
+            self._watch_rollouts(kubectl, self._watched_objects(manifests))
+
+    def _get_deploy_clusters(self, env: str) -> List[str]:
+        """
+        Returns list of clusters given by `--all-clusters` or `--clusters`, empty list for single cluster deploy.
+        """
+        if not self.args.all_clusters and not self.args.clusters:
+            return []
+
+        if self.args.cluster:
+            self.fail("Cluster argument can not be combined with --all-clusters or --clusters.")
+        if self.args.apply_output_dir:
+            self.fail("Option --apply-output-dir can not be combined with --all-clusters or --clusters.")
+
+        if self.args.all_clusters:
+            return list(self.envs_config_module.ENVS[env]['k8s_clusters'])
+
+        clusters = []
+        for cluster in self.args.clusters.split(','):
+            cluster = self._resolve_cluster(env, cluster.strip())
+            if cluster not in self.envs_config_module.ENVS[env]['k8s_clusters']:
+                self.fail("Unknown cluster '{}' for environment '{}'.".format(cluster, env))
+            if cluster not in clusters:
+                clusters.append(cluster)
+        return clusters
+
+    def _k8s_deploy_to_clusters(self, env: str, clusters: List[str]) -> None:
+        """
+        Renders manifests for each cluster and applies them to all given clusters in parallel.
+        """
+        # contexts may need to be created interactively, so we check them before going parallel
+        for cluster in clusters:
+            self._ensure_k8s_context(env, cluster)
+
+        # config may depend on the cluster (app.args.cluster), so it is evaluated and rendered for each of them,
+        # only applying runs in parallel
+        targets = {}  # type: Dict[str, Tuple[List[Dict[str, Any]], Tuple[Dict[str, int], List[str]]]]
+        noninteractive = self.args.noninteractive
+        if len(clusters) > 1 and not noninteractive:
+            # manifesty se lisi podle clusteru, editaci bychom nabizeli pro kazdy cluster znovu
+            self._out("Manifests are not offered for editing when deploying to several clusters.")
+            self.args.noninteractive = True
+        try:
+            for cluster in clusters:
+                self.args.cluster = cluster
+                self.config_module = self._import_config(env)
+                manifests = self._render_k8s_objects()
+                targets[cluster] = (manifests, self._watched_objects(manifests))
+        finally:
+            self.args.noninteractive = noninteractive
+            self.args.cluster = None
+
+        self._apply_to_clusters(env, targets)
+
+    def _apply_to_clusters(
+            self, env: str, targets: Dict[str, Tuple[List[Dict[str, Any]], Tuple[Dict[str, int], List[str]]]]
+    ) -> None:
+        """
+        Applies manifests to clusters in parallel, `targets` maps cluster to its manifests and watched objects.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        def deploy_to_cluster(cluster: str) -> List[str]:
+            manifests, watched = targets[cluster]
+            kubectl = self._kubectl_base(env, cluster)
+            failed_objects = self._apply_manifests(manifests, kubectl=kubectl)
+            if not failed_objects and self.args.watch:
+                failed_objects = self._watch_rollouts(kubectl, watched, fail_on_error=False)
+            return failed_objects
+
+        with ThreadPoolExecutor(max_workers=self.args.workers) as executor:
+            results = dict(zip(targets, executor.map(deploy_to_cluster, targets)))
+
+        self._out("\nDeploy summary for environment {}:".format(env))
+        for cluster, failed_objects in results.items():
+            if failed_objects:
+                self._out("{}: FAILED {}".format(cluster, failed_objects))
+            else:
+                self._out("{}: OK".format(cluster))
+
+        failed_clusters = [cluster for cluster, failed_objects in results.items() if failed_objects]
+        if failed_clusters:
+            self.fail("Vindaloo stopped working due to failed clusters: {}".format(failed_clusters))
+
+    def compile_bundle(self) -> None:
+        """
+        Renders K8S objects of all envs and clusters into a bundle, which `apply-bundle` deploys without configs.
+
+        Manifests are stored once, named by sha256 of their content, index.json lists them for every env and cluster
+        together with deployments and jobs to wait for.
+        """
+        bundle_dir = self.args.output_dir
+        objects_dir = os.path.join(bundle_dir, BUNDLE_OBJECTS_DIR)
+        # unused objects of previous compilation are deleted, so only bundle can be compiled again
+        if os.path.isdir(bundle_dir) and os.listdir(bundle_dir) and not os.path.isfile(
+                os.path.join(bundle_dir, BUNDLE_INDEX)
+        ):
+            self.fail("Directory {} is not empty and it is not a bundle, choose another --output-dir.".format(bundle_dir))
+        os.makedirs(objects_dir, exist_ok=True)
+        self.args.noninteractive = True  # manifests are not offered for editing, bundle is applied as it is
+
+        targets = {}  # type: Dict[str, Dict[str, Any]]
+        for env, env_config in self.envs_config_module.ENVS.items():
+            for cluster in env_config.get('k8s_clusters', []):
+                # config may depend on the cluster (app.args.cluster), registry depends on the environment
+                self.args.environment = env
+                self.args.cluster = cluster
+                self.config_module = self._import_config(env)
+                if not self.config_module:
+                    self._out("skipping environment {}, it does not have configuration".format(env))
+                    break
+
+                manifests = self._render_k8s_objects()
+                for manifest in manifests:
+                    path = os.path.join(objects_dir, manifest['digest'])
+                    if not os.path.exists(path):
+                        with open(path, 'wb') as fp:
+                            fp.write(manifest['data'])
+
+                deadlines, job_names = self._watched_objects(manifests)
+                targets.setdefault(env, {})[cluster] = {
+                    'objects': [
+                        {
+                            'type': manifest['type'], 'name': manifest['name'],
+                            'digest': manifest['digest'], 'stamp': manifest['stamp'],
+                        }
+                        for manifest in manifests
+                    ],
+                    'deployments': deadlines,
+                    'jobs': job_names,
+                }
+
+        # objects of previous compilation which are not used any more
+        digests = {
+            obj['digest'] for clusters in targets.values() for target in clusters.values() for obj in target['objects']
+        }
+        for name in os.listdir(objects_dir):
+            if name not in digests:
+                os.unlink(os.path.join(objects_dir, name))
+
+        with open(os.path.join(bundle_dir, BUNDLE_INDEX), 'w') as fp:
+            json.dump({'version': VERSION, 'targets': targets}, fp, indent=1, sort_keys=True)
+        self._out("Bundle {} created: {} objects for {} environments.".format(bundle_dir, len(digests), len(targets)))
+
+    def apply_bundle(self) -> None:
+        """
+        Applies manifests of compiled bundle to the clusters of environment, env config is not evaluated.
+        """
+        env = self.args.environment
+        if env not in self.envs_config_module.ENVS:
+            self.fail("Unknown environment '{}'.".format(env))
+
+        index_path = os.path.join(self.args.bundle, BUNDLE_INDEX)
+        try:
+            with open(index_path, 'r') as fp:
+                index = json.load(fp)
+            bundle_version = index['version']
+            compiled = index['targets'].get(env)
+        except (OSError, ValueError, KeyError, AttributeError) as ex:
+            self.fail("Can not read bundle index {}: {}".format(index_path, ex))
+        if not self._is_bundle_compatible(bundle_version):
+            self.fail("Bundle {} was compiled by incompatible vindaloo {}, current version: {}".format(
+                self.args.bundle, bundle_version, VERSION
+            ))
+        if not compiled:
+            self.fail("Bundle {} does not contain environment '{}'.".format(self.args.bundle, env))
+
+        clusters = self._get_deploy_clusters(env) or [self._resolve_cluster(env, self.args.cluster)]
+        targets = {}  # type: Dict[str, Tuple[List[Dict[str, Any]], Tuple[Dict[str, int], List[str]]]]
+        for cluster in clusters:
+            if cluster not in compiled:
+                self.fail("Bundle {} does not contain cluster '{}' of environment '{}'.".format(
+                    self.args.bundle, cluster, env
+                ))
+            # contexts may need to be created interactively, so we check them before going parallel
+            self._ensure_k8s_context(env, cluster)
+            targets[cluster] = (
+                [dict(obj, data=self._read_bundle_object(obj['digest'])) for obj in compiled[cluster]['objects']],
+                (compiled[cluster]['deployments'], compiled[cluster]['jobs']),
+            )
+
+        self._apply_to_clusters(env, targets)
+
+    @staticmethod
+    def _is_bundle_compatible(bundle_version: str) -> bool:
+        """
+        Bundle is readable by the same major version which is not older than the one which compiled it.
+        """
+        try:
+            bundle = tuple(int(part) for part in str(bundle_version).split('.'))
+        except ValueError:
+            return False
+        current = tuple(int(part) for part in VERSION.split('.'))
+        return bundle[:1] == current[:1] and bundle <= current
+
+    def _read_bundle_object(self, digest: str) -> bytes:
+        """
+        Reads manifest from bundle and checks it matches its digest.
+        """
+        path = os.path.join(self.args.bundle, BUNDLE_OBJECTS_DIR, digest)
+        try:
+            with open(path, 'rb') as fp:
+                data = fp.read()
+        except OSError as ex:
+            self.fail("Can not read bundle object: {}".format(ex))
+        if self._digest(data) != digest:
+            self.fail("Bundle object {} is corrupted.".format(path))
+        return data
+
+    def _apply_manifests(self, manifests: List[Dict[str, Any]], kubectl: List[str]) -> List[str]:
+        """
+        Applies rendered manifests, returns list of objects which failed.
+
+        Objects whose digest annotation equals the one of the live object in the cluster are skipped
+        unless `--force` is used.
+        """
+        if self.args.dryrun or self.args.apply_output_dir or self.args.force:
+            to_apply = manifests
+        else:
+            live_digests = self._live_digests(manifests, kubectl)
+            to_apply = []
+            for manifest in manifests:
+                stamp = manifest.get('stamp')
+                if stamp and live_digests.get((stamp[0], stamp[1])) == stamp[2]:
+                    self._out('skipping {} {}, unchanged in the cluster...'.format(manifest['type'], manifest['name']))
+                    continue
+                to_apply.append(manifest)
+
+        if self.args.batch and not self.args.apply_output_dir:
+            failed_objects = self._kubectl_apply_batch(to_apply, kubectl)
+        else:
+            _, failed_objects = self._kubectl_apply_in_tiers(to_apply, kubectl)
+
+        if to_apply and not self.args.dryrun and not self.args.apply_output_dir:
+            self._invalidate_cached_images_inventory(kubectl)
+
+        return failed_objects
+
+    def _live_digests(self, manifests: List[Dict[str, Any]], kubectl: List[str]) -> Dict[Tuple[str, str], str]:
+        """
+        Digest annotations of live objects of the namespace, read by one `kubectl get` of all kinds of `manifests`.
+
+        When the objects can't be read (e.g. kind unknown to the cluster), nothing is skipped.
+        """
+        kinds = sorted({manifest['stamp'][0] for manifest in manifests if manifest.get('stamp')})
+        if not kinds:
+            return {}
+
+        res = self.kubectl_cmd(
+            kubectl, ['get', ','.join(kinds), '-o', 'jsonpath={}'.format(LIVE_DIGESTS_JSONPATH)],
+            get_stdout=True, run_always=True,
+        )
+        if res.returncode != 0:
+            return {}
+
+        digests = {}
+        for line in res.stdout.decode('utf-8').split('\n'):
+            parts = line.split('\t')
+            if len(parts) == 3 and parts[2]:
+                digests[(parts[0].lower(), parts[1])] = parts[2]
+        return digests
+
+    def _kubectl_apply_in_tiers(
+            self, manifests: List[Dict[str, Any]], kubectl: List[str]
+    ) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """
+        Applies manifests tier by tier according to K8S_OBJECT_TYPES_YAML_PREFIX.
+        Objects of one tier are applied concurrently, next tier starts when the whole tier is applied.
+        Returns applied manifests and list of objects which failed.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        tiers = {}  # type: Dict[int, List[Dict[str, Any]]]
+        for manifest in manifests:
+            tier = int(K8S_OBJECT_TYPES_YAML_PREFIX.get(manifest['type'], len(K8S_OBJECT_TYPES_YAML_PREFIX) + 1))
+            tiers.setdefault(tier, []).append(manifest)
+
+        def apply(manifest: Dict[str, Any]) -> bool:
+            return self.kubectl_apply(
+                manifest['data'], name=manifest['name'], object_type=manifest['type'], kubectl=kubectl
+            )
+
+        applied = []
+        with ThreadPoolExecutor(max_workers=self.args.apply_workers or DEFAULT_APPLY_WORKERS) as executor:
+            for tier in sorted(tiers):
+                results = list(zip(tiers[tier], executor.map(apply, tiers[tier])))
+                applied.extend(manifest for manifest, success in results if success)
+                failed_objects = [
+                    '{} {}'.format(manifest['type'], manifest['name']) for manifest, success in results if not success
+                ]
+                if failed_objects:
+                    return applied, failed_objects
+
+        return applied, []
+
+    def _images_inventory_cache_path(self, kubectl: List[str]) -> str:
+        namespace = kubectl[kubectl.index('--namespace') + 1] if '--namespace' in kubectl else ''
+        return os.path.join(
+            self._cache_dir(VERSIONS_CACHE_DIR), '{}_{}.json'.format(self._kubectl_context(kubectl), namespace)
+        )
+
+    def _load_cached_images_inventory(self, kubectl: List[str]) -> Optional[Tuple[Dict[Tuple[str, str, str], str], float]]:
+        """
+        Returns images inventory cached within VERSIONS_CACHE_TTL and age of the cache in seconds.
+        """
+        ttl = getattr(self.envs_config_module, 'VERSIONS_CACHE_TTL', DEFAULT_VERSIONS_CACHE_TTL)
+        try:
+            with open(self._images_inventory_cache_path(kubectl), 'r') as fp:
+                cached = json.load(fp)
+            age = time.time() - cached['time']
+            inventory = {(kind, name, container): image for kind, name, container, image in cached['inventory']}
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+        if not 0 <= age < ttl:
+            return None
+        return inventory, age
+
+    def _store_cached_images_inventory(self, kubectl: List[str], inventory: Dict[Tuple[str, str, str], str]) -> None:
+        with open(self._images_inventory_cache_path(kubectl), 'w') as fp:
+            json.dump({'time': time.time(), 'inventory': [list(key) + [image] for key, image in inventory.items()]}, fp)
+
+    def _invalidate_cached_images_inventory(self, kubectl: List[str]) -> None:
+        try:
+            os.remove(self._images_inventory_cache_path(kubectl))
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _cache_dir(*parts: str) -> str:
+        """
+        Returns (and creates) directory for vindaloo's cached data.
+        """
+        base_dir = os.getenv(CACHE_DIR_ENV) or os.path.join(
+            os.getenv('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+            'vindaloo',
+        )
+        path = os.path.join(base_dir, *parts)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _watched_objects(self, manifests: List[Dict[str, Any]]) -> Tuple[Dict[str, int], List[str]]:
+        """
+        Deployments (with their progress deadline) and jobs of current environment config, which deploy waits for.
+
+        Progress deadline of templates is read from their rendered `manifests`.
+        """
+        rendered_deadlines = {}  # type: Dict[str, Optional[int]]
+        for manifest in manifests:
+            if manifest['type'] == 'deployment' and manifest['stamp']:  # stamped manifest is JSON
+                spec = json.loads(manifest['data'].decode('utf-8')).get('spec') or {}
+                rendered_deadlines[manifest['name']] = spec.get('progressDeadlineSeconds')
+
+        deadlines = {}  # type: Dict[str, int]
+        for yaml_conf in self.config_module.K8S_OBJECTS.get('deployment', []):
+            if isinstance(yaml_conf, JsonSerializable):
+                deployment_name = yaml_conf.name
+                deadline = yaml_conf.spec.children.get('progressDeadlineSeconds')
+            else:
+                deployment_name = yaml_conf.get('config', {}).get('ident_label', '')
+                deadline = rendered_deadlines.get(deployment_name)
+            if deployment_name:
+                deadlines[deployment_name] = deadline or DEFAULT_PROGRESS_DEADLINE
+
+        job_names = [
+            yaml_conf.name for yaml_conf in self.config_module.K8S_OBJECTS.get('job', [])
+            if isinstance(yaml_conf, JsonSerializable) and yaml_conf.name
+        ]
+        return deadlines, job_names
+
+    def _watch_rollouts(
+            self, kubectl: List[str], watched: Tuple[Dict[str, int], List[str]], fail_on_error: bool = True
+    ) -> List[str]:
+        """
+        Waits for `watched` deployments to roll out and jobs to finish.
+        """
+        deadlines, job_names = watched
+
+        failed_deployments = self._watch_deployments(deadlines, kubectl)
+        if failed_deployments:
+            if fail_on_error:
+                self.fail("Vindaloo stopped working due to failed deployments: {}".format(failed_deployments))
+            return ['deployment {}'.format(name) for name in failed_deployments]
+
+        failed_jobs = self._watch_jobs(job_names, kubectl)
+
+        if failed_jobs and fail_on_error:
+            self.fail("Vindaloo stopped working due to failed jobs: {}".format(failed_jobs))
 
-        # pro jednotlive typy souboru vygenerujeme yaml soubory a nasadime je
+        return ['job {}'.format(name) for name in failed_jobs]
+
+    @timed('job wait')
+    def _watch_jobs(self, job_names: List[str], kubectl: List[str]) -> List[str]:
+        """
+        Waits for jobs to finish using one watch stream for all jobs in namespace, returns list of failed jobs.
+
+        When the watch stream drops, it is opened again with exponential backoff.
+        """
+        import subprocess
+        if not job_names:
+            return []
+
+        self._out('Waiting for jobs {} to finish'.format(', '.join(job_names)))
+        if self.args.dryrun:
+            # nic nebezi, prazdny watch by se jen dokola znovu otviral
+            return []
+
+        pending = set(job_names)
+        failed_jobs = []
+        backoff = JOB_WATCH_MIN_BACKOFF
+        attempts = 0
+        while pending:
+            process = self.spawn(kubectl + [
+                "get", "jobs", "--watch",
+                "-o", 'jsonpath={.metadata.name}{"\\t"}{.status.succeeded}{"\\t"}{.status.failed}{"\\n"}',
+            ], stdout=subprocess.PIPE)
+
+            for line in iter(process.stdout.readline, b''):
+                parts = line.decode('utf-8', 'replace').rstrip('\n').split('\t')
+                if len(parts) != 3 or parts[0] not in pending:
+                    continue
+                # stream works, so next reconnect starts with short backoff again
+                backoff = JOB_WATCH_MIN_BACKOFF
+                attempts = 0
+
+                job_name, succeeded, failed = parts
+                if succeeded:
+                    pending.remove(job_name)
+                    self._out("Job {} ended successfully.".format(job_name))
+                elif failed:
+                    pending.remove(job_name)
+                    failed_jobs.append(job_name)
+                    self._out("Job {} failed.".format(job_name))
+
+                if not pending:
+                    break
+
+            process.terminate()
+            process.wait()
+
+            if pending:
+                attempts += 1
+                if attempts > JOB_WATCH_MAX_RETRIES:
+                    self._out("Watching of jobs failed, unknown result of jobs: {}".format(', '.join(sorted(pending))))
+                    failed_jobs.extend(sorted(pending))
+                    break
+                self._out("Watch of jobs dropped, reconnecting in {} seconds...".format(backoff))
+                time.sleep(backoff)
+                backoff = min(backoff * 2, JOB_WATCH_MAX_BACKOFF)
+
+        return failed_jobs
+
+    @timed('rollout wait')
+    def _watch_deployments(self, deadlines: Dict[str, int], kubectl: List[str]) -> List[str]:
+        """
+        Watches rollouts of all deployments at once, returns list of failed deployments.
+
+        Waiting is aborted as soon as one rollout fails or does not finish within its `progressDeadlineSeconds`
+        from the start of the rollout.
+        """
+        import tempfile
+        if not deadlines:
+            return []
+
+        self._out('Waiting for rollout of {} to finish'.format(', '.join(deadlines)))
+
+        outputs = {}
+        processes = {}
+        started = time.monotonic()
+        for name in deadlines:
+            # output goes into file, so full pipe can't block kubectl
+            outputs[name] = tempfile.TemporaryFile("w+b")
+            processes[name] = self.spawn(kubectl + ["rollout", "status", "deployment", name], stdout=outputs[name])
+
+        pending = list(deadlines)
+        finished = []
+        failed = {}  # type: Dict[str, str]
+        while pending and not failed:
+            for name in list(pending):
+                returncode = processes[name].poll()
+                if returncode is None:
+                    # vystup kubectl neni mirou postupu, pocitame od zacatku rolloutu
+                    if time.monotonic() - started > deadlines[name]:
+                        processes[name].terminate()
+                        failed[name] = "not rolled out in {} seconds".format(deadlines[name])
+                        pending.remove(name)
+                    continue
+
+                pending.remove(name)
+                if returncode == 0:
+                    finished.append(name)
+                else:
+                    outputs[name].seek(0)
+                    failed[name] = outputs[name].read().decode('utf-8', 'replace').strip()
+
+                self._out('Rollouts finished: {}/{}{}'.format(
+                    len(finished),
+                    len(deadlines),
+                    ', waiting for: {}'.format(', '.join(pending)) if pending else '',
+                ))
+
+            if pending and not failed:
+                time.sleep(ROLLOUT_POLL_INTERVAL)
+
+        for name in pending:
+            processes[name].terminate()
+        for output in outputs.values():
+            output.close()
+
+        if failed:
+            self._out('\nRollout failed:')
+            for name, reason in failed.items():
+                self._out('{}: {}'.format(name, reason))
+            if pending:
+                self._out('Stopped waiting for: {}'.format(', '.join(pending)))
+
+        return list(failed)
+
+    def _render_k8s_objects(self) -> List[Dict[str, Any]]:
+        """
+        Renders all K8S objects of current environment in order given by K8S_OBJECT_TYPES.
+        """
+        manifests = []
+        # pro jednotlive typy souboru vygenerujeme yaml soubory
         for obj_type in K8S_OBJECT_TYPES:
             if obj_type not in self.config_module.K8S_OBJECTS:
                 continue  # Pokud tenhle typ nema tak jedeme dal
 
             for yaml_conf in self.config_module.K8S_OBJECTS[obj_type]:
                 if isinstance(yaml_conf, JsonSerializable):
-                    temp_file = self._create_json_file_from_object(yaml_conf)
                     ident = yaml_conf.name
+                    data = self._serialize_object(yaml_conf)
+                    file_label = "{}-{}.json".format(yaml_conf.name, yaml_conf.obj_type)
                 else:
                     # pridame registry
                     yaml_conf['config']['registry'] = self.registry
 
-                    temp_file = self.create_file(yaml_conf['template'], yaml_conf['config'], from_templates=True)
                     ident = yaml_conf['config'].get('ident_label', 'unnamed')
+                    data = bytes(self.render_template(yaml_conf['template'], yaml_conf['config'], from_templates=True), 'utf-8')
+                    file_label = yaml_conf['template']
 
-                if not temp_file:
+                if not data:
                     self.fail("Error while creating deployment file.")
 
-                assert self.kubectl_apply(
-                    temp_file.name, name=ident, object_type=obj_type
-                )
+                data, stamp = self._stamp_manifest(self._offer_edit(file_label, data))
 
-        if self.args.watch:
-            failed_deployments = []
-            for yaml_conf in self.config_module.K8S_OBJECTS.get('deployment', []):
-                if isinstance(yaml_conf, JsonSerializable):
-                    deployment_name = yaml_conf.name
-                else:
-                    deployment_name = yaml_conf.get('config', {}).get('ident_label', '')
-                if deployment_name:
-                    self._out('Waiting for rollout {} to finish'.format(deployment_name))
-                    if not self._cmd_check(["kubectl", "rollout", "status", "deployment", deployment_name]):
-                        failed_deployments.append(deployment_name)
-
-            failed_jobs = []
-            for yaml_conf in self.config_module.K8S_OBJECTS.get('job', []):
-                if isinstance(yaml_conf, JsonSerializable):
-                    job_name = yaml_conf.name
-
-                if job_name:
-                    self._out('Waiting for job {} to finish'.format(job_name))
-                    succeeded, failed = None, None
-                    while not succeeded and not failed:
-                        time.sleep(60)  # one minute wait for not messing up kube
-                        succeeded = self.cmd(["kubectl", "get", "job", job_name, "-o", "jsonpath={.status.succeeded}"], get_stdout=True).stdout
-                        failed = self.cmd(["kubectl", "get", "job", job_name, "-o", "jsonpath={.status.failed}"], get_stdout=True).stdout
-                        if succeeded:
-                            self._out("Job {} ended successfully.".format(job_name))
-                        if failed:
-                            failed_jobs.append(job_name)
-                            self._out("Job {} failed.".format(job_name))
-
-            if failed_deployments:
-                self.fail("Vindaloo stopped working due to failed deployments: {}".format(failed_deployments))
-            if failed_jobs:
-                self.fail("Vindaloo stopped working due to failed jobs: {}".format(failed_jobs))
+                manifests.append({
+                    'type': obj_type, 'name': ident, 'data': data, 'digest': self._digest(data), 'stamp': stamp,
+                })
+
+        return manifests
 
-    def kubectl_apply(self, filename: str, name: str = 'unnamed', object_type: str = 'k8s_object') -> bool:
+    def _kubectl_apply_batch(self, manifests: List[Dict[str, Any]], kubectl: List[str]) -> List[str]:
         """
-        Apply k8s JSON or save into output dir, when specified on command line.
+        Applies all manifests as one multi-document stream using single kubectl call.
+        When the batch fails, objects are applied one by one to find out which of them failed.
+        """
+        if not manifests:
+            return []
+
+        documents = [manifest['data'].strip() for manifest in manifests]
+        if self.kubectl_apply(b'\n---\n'.join(documents) + b'\n', name='batch', object_type='list', kubectl=kubectl):
+            return []
+
+        self._out("Batch apply failed, applying objects one by one...")
+        return [
+            '{} {}'.format(manifest['type'], manifest['name'])
+            for manifest in manifests
+            if not self.kubectl_apply(
+                manifest['data'], name=manifest['name'], object_type=manifest['type'], kubectl=kubectl
+            )
+        ]
+
+    @timed('kubectl apply')
+    def kubectl_apply(
+            self, data: bytes, name: str = 'unnamed', object_type: str = 'k8s_object', kubectl: List[str] = None
+    ) -> bool:
+        """
+        Apply k8s JSON (passed to kubectl on stdin) or save into output dir, when specified on command line.
         """
         if self.args.dryrun:
-            self._out("CALL: kubectl apply -f {}".format(filename))
+            self._out("CALL: kubectl apply -f - ({} {})".format(object_type, name))
             return True
         elif self.args.apply_output_dir:
             os.makedirs(self.args.apply_output_dir, exist_ok=True)
@@ -297,28 +951,70 @@ class Vindaloo:
                 self.args.apply_output_dir,
                 "{}{}_{}.json".format(prefix_, name, object_type)
             )
-            shutil.copy(filename, dest_filename)
+            with open(dest_filename, 'wb') as fp:
+                fp.write(data)
             self._out("{} created.".format(dest_filename))
             return True
         else:
-            res = self.cmd(["kubectl", "apply", "-f", filename])
+            res = self.kubectl_cmd(kubectl or ["kubectl"], ["apply", "-f", "-"], input=data)
             return res.returncode == 0
 
+    @timed('global config import')
     def _import_envs_config(self) -> None:
         """
         Reads main configuration containing list of clusters and namespaces.
+
+        Found file is remembered for the cwd in the cache dir while its mtime does not change,
+        it is loaded using bytecode cache (__pycache__) like any other module.
         """
-        dir = os.path.abspath(os.getcwd())
+        path = self._find_envs_config(os.path.abspath(os.getcwd()))
+        if path:
+            self.envs_config_module = self._load_source(ENVS_CONFIG_NAME, path)
+
+    def _find_envs_config(self, cwd: str) -> Optional[str]:
+        """
+        Path of vindaloo_conf.py in cwd or its nearest parent dir, lookups are shared by all invocations.
+        """
+        cache_path = os.path.join(self._cache_dir(), ENVS_CONFIG_PATHS_FILE)
+        try:
+            with open(cache_path, 'r') as fp:
+                paths = json.load(fp)  # type: Dict[str, List[Any]]
+        except (OSError, ValueError):
+            paths = {}
 
+        if cwd in paths:
+            path, mtime = paths[cwd]
+            try:
+                if os.stat(path).st_mtime_ns == mtime:
+                    return path
+            except OSError:
+                pass
+
+        dir = cwd
         while dir != '/':
-            module = os.path.join(dir, ENVS_CONFIG_NAME)
-            path = '{}.py'.format(module)
+            path = os.path.join(dir, '{}.py'.format(ENVS_CONFIG_NAME))
             if os.path.isfile(path):
-                self.envs_config_module = imp.load_source(module, path)
-                break
+                paths[cwd] = [path, os.stat(path).st_mtime_ns]
+                try:
+                    with open(cache_path, 'w') as fp:
+                        json.dump(paths, fp)
+                except OSError:
+                    pass
+                return path
 
             # try parent dir.
             dir = os.path.abspath(os.path.join(dir, '..'))
+        return None
+
+    @staticmethod
+    def _load_source(name: str, path: str) -> Any:
+        """
+        Loads python file as module (without registering it in sys.modules), compiled code is cached in __pycache__.
+        """
+        loader = SourceFileLoader(name, path)
+        module = module_from_spec(spec_from_loader(name, loader))
+        loader.exec_module(module)
+        return module
 
     def _load_versions(self):
         """
@@ -330,39 +1026,171 @@ class Vindaloo:
         with open('{}/versions.json'.format(CONFIG_DIR)) as fp:
             content = fp.read()
             if GIT_HASH_PLACEHOLDER in content:
-                res = self.cmd(
-                    ['git', 'rev-parse', '--short=8', 'HEAD'],
-                    run_always=True,
-                    get_stdout=True,
-                )
-                commit_hash = res.stdout.decode('utf8').strip()
-                content = chevron.render(content, {'git': commit_hash})
+                import chevron
+                content = chevron.render(content, {'git': self._git_short_hash()})
 
         self.versions = json.loads(content)
 
     def _import_config(self, env: str) -> Any:
         """
         Nacte konfiguraci pro zadane prostredi
+
+        Each env config is evaluated once per process (and selected environment and cluster, which the config
+        may read from `app.args`), `invalidate_config` forces the next import to evaluate it again.
+        """
+        key = self._config_key(env)
+        if key not in self.config_modules:
+            self.config_modules[key] = self._evaluate_config(env)
+        return self.config_modules[key]
+
+    def _config_key(self, env: str) -> Tuple[str, Optional[str], Optional[str]]:
+        """
+        Evaluated config of `env` depends also on selected environment (e.g. registry) and cluster.
+        """
+        return env, getattr(self.args, 'environment', None), getattr(self.args, 'cluster', None)
+
+    def invalidate_config(self, env: str = None) -> None:
+        """
+        Forgets evaluated configuration of `env` (of all envs and versions.json when `env` is None).
+        """
+        if env is None:
+            self.config_modules.clear()
+            self.config_snapshots.clear()
+            self.versions = {}
+            return
+
+        for memo in (self.config_modules, self.config_snapshots):
+            for key in [key for key in memo if key[0] == env]:
+                del memo[key]
+
+    def _config_snapshot(self, env: str) -> Any:
+        """
+        DOCKER_FILES and K8S_OBJECTS of the env config, without evaluating it when its inputs did not change.
+
+        Evaluated objects are pickled to the cache dir together with digest of their inputs (files of k8s dir,
+        vindaloo_conf.py, git HEAD used by versions.json). Commands which only read images and objects
+        (build, push, pull, versions, completion) use the snapshot, deploy evaluates the config itself.
+
+        Snapshots are turned on by `CONFIG_SNAPSHOTS = True` in vindaloo_conf.py, only for configs which
+        don't depend on anything else (e.g. env variables). Snapshot files which are not owned by the current
+        user or are writable by others are ignored, unpickling them could run foreign code.
+        """
+        import pickle
+
+        key = self._config_key(env)
+        if key in self.config_snapshots:
+            return self.config_snapshots[key]
+        if not os.path.isfile("{}/{}.py".format(CONFIG_DIR, env)):
+            return None
+        if key in self.config_modules or not getattr(self.envs_config_module, 'CONFIG_SNAPSHOTS', False):
+            return self._import_config(env)
+
+        digest = self._config_inputs_digest(env)
+        path = self._config_snapshot_path(env)
+        try:
+            with open(path, 'rb') as fp:
+                stat = os.fstat(fp.fileno())
+                if stat.st_uid == os.getuid() and not stat.st_mode & 0o022:
+                    cached_digest, data = pickle.load(fp)
+                    if cached_digest == digest:
+                        self.config_snapshots[key] = argparse.Namespace(**data)
+                        return self.config_snapshots[key]
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            pass  # chybejici nebo nekompatibilni snapshot, konfiguraci vyhodnotime
+
+        config_module = self._import_config(env)
+        if config_module:
+            data = {
+                'DOCKER_FILES': getattr(config_module, 'DOCKER_FILES', []),
+                'K8S_OBJECTS': getattr(config_module, 'K8S_OBJECTS', {}),
+            }
+            import tempfile
+            # mkstemp creates the file readable only by the current user, replace keeps it so
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as fp:
+                    pickle.dump((digest, data), fp, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(temp_path, path)
+            except (OSError, pickle.PicklingError, TypeError, AttributeError):
+                # config with objects which can't be pickled (e.g. lambdas) is just evaluated every time
+                for stale_path in (temp_path, path):
+                    if os.path.exists(stale_path):
+                        os.unlink(stale_path)
+        return config_module
+
+    def _config_snapshot_path(self, env: str) -> str:
+        """
+        Snapshot file of the env, one per project dir, env, selected environment and cluster.
+        """
+        import hashlib
+
+        name = json.dumps([os.getcwd()] + list(self._config_key(env)))
+        return os.path.join(
+            self._cache_dir(CONFIG_SNAPSHOTS_DIR),
+            '{}_{}.pickle'.format(env, hashlib.sha256(name.encode()).hexdigest()[:16]),
+        )
+
+    def _config_inputs_digest(self, env: str) -> str:
+        """
+        Digest of everything the evaluated env config depends on.
+        """
+        import hashlib
+
+        inputs = [VERSION] + list(self._config_key(env))  # type: List[Any]
+        paths = [getattr(self.envs_config_module, '__file__', None)]
+        for root, dirs, files in os.walk(CONFIG_DIR):
+            dirs[:] = sorted(name for name in dirs if name != '__pycache__')
+            paths.extend(os.path.join(root, name) for name in sorted(files))
+        for path in paths:
+            if path and os.path.isfile(path):
+                stat = os.stat(path)
+                inputs.append([path, stat.st_mtime_ns, stat.st_size])
+
+        with open('{}/versions.json'.format(CONFIG_DIR)) as fp:
+            if GIT_HASH_PLACEHOLDER in fp.read():
+                inputs.append(str(self._git_short_hash()))
+
+        return hashlib.sha256(json.dumps(inputs).encode()).hexdigest()
+
+    def _git_short_hash(self) -> str:
+        """
+        Abbreviated hash of HEAD, read from .git directly when possible.
+        """
+        if self.git_hash:
+            return self.git_hash
+
+        commit_hash = git_head_commit(os.getcwd())
+        if commit_hash:
+            self.git_hash = commit_hash[:8]
+            return self.git_hash
+
+        res = self.cmd(
+            ['git', 'rev-parse', '--short=8', 'HEAD'],
+            run_always=True,
+            get_stdout=True,
+        )
+        self.git_hash = res.stdout.decode('utf8').strip()
+        return self.git_hash
+
+    @timed('env config import')
+    def _evaluate_config(self, env: str) -> Any:
+        """
+        Evaluates configuration module of the environment again.
+
+        Modules of the config dir are evaluated in isolated namespace (see `ConfigLoader`) where `vindaloo.app`
+        is this instance, so several envs can be evaluated at the same time.
         """
         # Make sure it's file, to prevent importing some module from python path with same name
         if not os.path.isfile("{}/{}.py".format(CONFIG_DIR, env)):
             return None
 
         self._load_versions()
-        sys.modules['vindaloo'].app = self
-        sys.path.insert(0, os.path.abspath(CONFIG_DIR))
         try:
-            # If there is already, remove from modules and import again
-            if env in sys.modules:
-                del sys.modules[env]
-            res_mod = import_module(env)
-            return res_mod
+            return ConfigLoader(CONFIG_DIR, self).load(env)
         except ModuleNotFoundError as ex:
             if env not in str(ex):
                 self.fail(f"Error importing env configuration: {ex}")
             return None
-        finally:
-            sys.path = sys.path[1:]
 
     def _check_current_dir(self) -> bool:
         """
@@ -371,10 +1199,12 @@ class Vindaloo:
         return os.path.isdir(CONFIG_DIR)
 
     def cmd(self, command: List[str],
-            get_stdout: bool = False, run_always: bool = False) -> subprocess.CompletedProcess:
+            get_stdout: bool = False, run_always: bool = False, input: bytes = None,
+            timeout: float = None) -> 'subprocess.CompletedProcess':
         """
         Runs command as subprocess.
         """
+        import subprocess
         if self.args.debug:
             self._out("CALL: ", ' '.join(command))
         if self.args.dryrun:
@@ -382,13 +1212,29 @@ class Vindaloo:
             if not run_always:
                 return subprocess.run('true')  # zavolam 'true' abych mohl vratit vysledek
 
-        kwargs = {}
+        kwargs = {}  # type: Dict[str, Any]
+        if input is not None:
+            kwargs['input'] = input
+        if timeout is not None:
+            kwargs['timeout'] = timeout
         if get_stdout:
             kwargs['stdout'] = subprocess.PIPE
             kwargs['stderr'] = subprocess.PIPE
 
         return subprocess.run(command, **kwargs)
 
+    def spawn(self, command: List[str], stdout: Any = None) -> 'subprocess.Popen':
+        """
+        Starts command as subprocess without waiting for it.
+        """
+        import subprocess
+        if self.args.debug or self.args.dryrun:
+            self._out("CALL: ", ' '.join(command))
+        if self.args.dryrun:
+            command = ['true']
+
+        return subprocess.Popen(command, stdout=stdout, stderr=subprocess.STDOUT if stdout else None)
+
     def _cmd_check(self, command: List[str], get_stdout: bool = False) -> bool:
         """
         Runs command and returns if finished successfully.
@@ -437,6 +1283,7 @@ class Vindaloo:
         """
         return [x for x in self.args.image if x]
 
+    @timed('docker build')
     def build_images(self) -> None:
         """
         Starts build of images without caching.
@@ -503,6 +1350,7 @@ class Vindaloo:
             res = self.cmd(["docker", "pull", image_name_with_tag])
             assert res.returncode == 0
 
+    @timed('docker push')
     def push_images(self) -> None:
         """
         Starts push into registry.
@@ -591,67 +1439,291 @@ class Vindaloo:
         for env in self.envs_config_module.ENVS:
             if only_env and only_env != env:
                 continue
-            if self._import_config(env):
+            config_module = self._config_snapshot(env)
+            if config_module:
                 images = {}
-                for df_config in self.config_module.DOCKER_FILES:
+                for df_config in config_module.DOCKER_FILES:
                     conf = df_config['config']
                     images[self._strip_image_name(conf['image_name'])] = conf['version']
                 local_versions[env] = images
 
         return local_versions
 
-    def _collect_remote_versions(self, only_env: str = None) -> Dict:
+    def _versions_targets(self, only_env: str = None) -> List[Tuple[str, str, Set[Tuple[str, str]]]]:
         """
-        List of images for individual K8S namespaces.
+        List of (env, cluster, configured (kind, name) workloads) whose versions are compared.
         """
-        remote_versions = {}  # type: Dict[str, Any]
+        targets = []  # type: List[Tuple[str, str, Set[Tuple[str, str]]]]
         for env in self.envs_config_module.ENVS:
             if only_env and only_env != env:
                 continue
 
-            if self._import_config(env):
-                for cluster in self.envs_config_module.ENVS[env].get('k8s_clusters', []):
-                    self._select_k8s_context(env, cluster)
-                    for deployment in self.config_module.K8S_OBJECTS.get("deployment", []):
-                        if isinstance(deployment, JsonSerializable):
-                            module_name = deployment.name
+            # konfigurace se importuje sekvencne, paralelne se jen ptame clusteru
+            config_module = self._config_snapshot(env)
+            if config_module:
+                objects = set()
+                for kind in VERSIONS_OBJECT_TYPES:
+                    for yaml_conf in config_module.K8S_OBJECTS.get(kind, []):
+                        if isinstance(yaml_conf, JsonSerializable):
+                            objects.add((kind, yaml_conf.name))
                         else:
-                            module_name = deployment['config']['ident_label']
-                        remote_images = self.get_k8s_deployment_version(module_name)
-                        if not remote_images:
-                            continue
-                        images = remote_versions.get(env, {}).get(cluster, {})
-                        for remote_image in remote_images:
-                            parts = remote_image.split(":")
-                            version = parts[-1]
-                            image = self._strip_image_name(":".join(parts[:-1]))
-                            images[image] = version
-                        remote_versions.setdefault(env, {})[cluster] = images
+                            objects.add((kind, yaml_conf['config']['ident_label']))
+                for cluster in self.envs_config_module.ENVS[env].get('k8s_clusters', []):
+                    targets.append((env, cluster, objects))
+        return targets
+
+    def _deployed_versions(
+            self, inventory: Dict[Tuple[str, str, str], str], objects: Set[Tuple[str, str]]
+    ) -> Dict[str, str]:
+        """
+        Versions of images (without registry) used by given (kind, name) workloads.
+        """
+        images = {}
+        for (kind, name, _), remote_image in sorted(inventory.items()):
+            if (kind, name) not in objects:
+                continue
+            parts = remote_image.split(":")
+            version = parts[-1]
+            image = self._strip_image_name(":".join(parts[:-1]))
+            images[image] = version
+        return images
+
+    def _collect_remote_versions(
+            self, only_env: str = None, on_result: Callable[[str, str, Dict[str, str], Optional[str], float], None] = None
+    ) -> Tuple[Dict, Dict, Dict]:
+        """
+        List of images for individual K8S namespaces, errors of env/clusters which could not be read
+        and age of cached results (0 when the cluster was queried now).
+
+        Envs sharing a cluster are read by one query across namespaces narrowed by VERSIONS_LABEL_SELECTOR
+        (when it is configured and more of them are not cached), otherwise namespace by namespace.
+        Clusters are queried in parallel, each query at most for `--timeout` seconds.
+        Results are cached for VERSIONS_CACHE_TTL seconds unless `--refresh` is used.
+        `on_result(env, cluster, images, error, age)` is called as soon as each env/cluster is known.
+        """
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+        import subprocess
+        targets = self._versions_targets(only_env)
+        # bez selectoru by dotaz pres vsechny namespaces stahoval cely cluster
+        selector = getattr(self.envs_config_module, 'VERSIONS_LABEL_SELECTOR', None)
+
+        def fetch(pending: List[int]) -> Dict[int, Tuple[Dict[str, str], Optional[str], float]]:
+            """
+            Versions of not cached targets on one physical cluster.
+            """
+            results = {}
+            inventories = {}  # type: Dict[int, Dict[Tuple[str, str, str], str]]
+            if selector and len(pending) > 1:
+                env, cluster, _ = targets[pending[0]]
+                try:
+                    by_namespace = self.get_k8s_images_inventories(
+                        self._kubectl_base(env, cluster)[:3], timeout=self.args.timeout, selector=selector,
+                    )
+                except subprocess.TimeoutExpired as ex:
+                    # cluster neodpovida, nema smysl se ptat po namespacech
+                    for i in pending:
+                        results[i] = {}, self._kubectl_error(ex), 0
+                    pending = []
+                except subprocess.CalledProcessError:
+                    pass  # e.g. not allowed to list across namespaces, we ask namespace by namespace
+                else:
+                    for i in pending:
+                        env, _, _ = targets[i]
+                        inventories[i] = by_namespace.get(self.envs_config_module.ENVS[env]['k8s_namespace'], {})
+
+            for i in pending:
+                env, cluster, objects = targets[i]
+                kubectl = self._kubectl_base(env, cluster)
+                if i not in inventories:
+                    try:
+                        inventories[i] = self.get_k8s_images_inventory(kubectl, timeout=self.args.timeout)
+                    except (subprocess.TimeoutExpired, subprocess.CalledProcessError) as ex:
+                        results[i] = {}, self._kubectl_error(ex), 0
+                        continue
+                if not self.args.dryrun:
+                    self._store_cached_images_inventory(kubectl, inventories[i])
+                results[i] = self._deployed_versions(inventories[i], objects), None, 0
+            return results
 
-        return remote_versions
+        remote_versions = {}  # type: Dict[str, Any]
+        errors = {}  # type: Dict[str, Dict[str, str]]
+        ages = {}  # type: Dict[str, Dict[str, float]]
+        if not targets:
+            return remote_versions, errors, ages
+
+        results = {}
+        clusters = {}  # type: Dict[str, List[int]]
+        for i, (env, cluster, objects) in enumerate(targets):
+            cached = None
+            if not self.args.refresh and not self.args.dryrun:
+                cached = self._load_cached_images_inventory(self._kubectl_base(env, cluster))
+            if cached:
+                results[i] = self._deployed_versions(cached[0], objects), None, cached[1]
+                if on_result:
+                    on_result(env, cluster, *results[i])
+                continue
+            # contexts may need to be created interactively, so we check them before going parallel
+            self._ensure_k8s_context(env, cluster)
+            # aliases of one physical cluster are read together
+            clusters.setdefault(self._resolve_cluster(env, cluster), []).append(i)
+
+        with ThreadPoolExecutor(max_workers=self.args.workers) as executor:
+            for future in as_completed([executor.submit(fetch, indexes) for indexes in clusters.values()]):
+                for i, result in sorted(future.result().items()):
+                    results[i] = result
+                    if on_result:
+                        env, cluster, _ = targets[i]
+                        on_result(env, cluster, *result)
+
+        # vysledky skladame v poradi konfigurace, ne v poradi dokonceni
+        for i, (env, cluster, _) in enumerate(targets):
+            images, error, age = results[i]
+            if error:
+                errors.setdefault(env, {})[cluster] = error
+                continue
+            ages.setdefault(env, {})[cluster] = age
+            if images:
+                remote_versions.setdefault(env, {})[cluster] = images
+
+        return remote_versions, errors, ages
 
     def collect_versions(self) -> None:
         """
         Compares local and remote image lists.
         """
+        if self.args.watch and (self.args.json or self.args.ndjson):
+            self.fail("--watch can't be combined with --json or --ndjson")
+
         local_ = self._collect_local_versions(self.args.environment)
-        remote_ = self._collect_remote_versions(self.args.environment)
+        if self.args.ndjson:
+            self._collect_remote_versions(
+                self.args.environment, on_result=functools.partial(self._print_versions_record, local_)
+            )
+            return
+
+        if self.args.watch:
+            self._watch_versions(local_)
+            return
+
+        remote_, errors, ages = self._collect_remote_versions(self.args.environment)
+        summary = self._versions_summary(local_, remote_, ages)
+
+        if self.args.json:
+            print(json.dumps(summary, indent=1))
+            for env in errors:
+                for cluster, error in errors[env].items():
+                    print("Error reading {} {}: {}".format(env, cluster, error), file=sys.stderr)
+
+        self._print_versions_summary(summary, errors, ages)
+
+    def _watch_versions(self, local_: Dict) -> None:
+        """
+        Keeps table of local and remote versions up to date using one watch of all configured kinds of workload
+        per context, until interrupted by Ctrl+C.
+
+        Kubectl which can't watch several kinds at once gets one watch per kind.
+        """
+        import subprocess
+        targets = [target for target in self._versions_targets(self.args.environment) if target[2]]
+        if not targets:
+            self._out("Nothing to watch, no environment has configured deployments, cronjobs or jobs.")
+            return
+        for env, cluster, _ in targets:
+            self._ensure_k8s_context(env, cluster)
+        inventories = {(env, cluster): {} for env, cluster, _ in targets}  # type: Dict[Tuple[str, str], Dict]
+        errors = {}  # type: Dict[str, Dict[str, str]]
+        processes = []  # type: List[subprocess.Popen]
+        changed = threading.Event()
+        stop = threading.Event()
+
+        def watch(env: str, cluster: str, kinds: List[str], objects: Set[Tuple[str, str]]) -> None:
+            inventory = inventories[(env, cluster)]
+            while not stop.is_set():
+                process = self.spawn(self._kubectl_base(env, cluster) + [
+                    "get", ",".join(kind + "s" for kind in kinds), "--watch", "--output-watch-events",
+                    "-o", 'jsonpath=' + VERSIONS_WATCH_JSONPATH,
+                ], stdout=subprocess.PIPE)
+                with self.lock:
+                    processes.append(process)
+
+                for line in iter(process.stdout.readline, b''):
+                    parts = line.decode('utf-8', 'replace').rstrip('\n').split('\t')
+                    if not parts[0]:
+                        continue
+                    if len(parts) != 4 and len(kinds) > 1 and 'only supported on individual resources' in parts[0]:
+                        process.wait()
+                        for kind in kinds:
+                            threading.Thread(target=watch, args=(env, cluster, [kind], objects), daemon=True).start()
+                        return
+                    with self.lock:
+                        if len(parts) != 4:
+                            # kubectl posila chyby na stejny vystup
+                            errors.setdefault(env, {})[cluster] = parts[0]
+                        elif (parts[1].lower(), parts[2]) in objects:
+                            kind, name = parts[1].lower(), parts[2]
+                            errors.get(env, {}).pop(cluster, None)
+                            for key in [key for key in inventory if key[:2] == (kind, name)]:
+                                del inventory[key]
+                            if parts[0] != 'DELETED':
+                                for container in parts[3].split():
+                                    container_name, _, image = container.partition('=')
+                                    inventory[(kind, name, container_name)] = image
+                        else:
+                            continue
+                    changed.set()
+
+                process.wait()
+                stop.wait(VERSIONS_WATCH_RECONNECT)
+
+        for env, cluster, objects in targets:
+            kinds = [kind for kind in VERSIONS_OBJECT_TYPES if any(object_kind == kind for object_kind, _ in objects)]
+            threading.Thread(target=watch, args=(env, cluster, kinds, objects), daemon=True).start()
+
+        try:
+            while True:
+                changed.wait()
+                changed.clear()
+                with self.lock:
+                    remote_ = {}  # type: Dict[str, Any]
+                    for env, cluster, objects in targets:
+                        remote_.setdefault(env, {})[cluster] = self._deployed_versions(
+                            inventories[(env, cluster)], objects
+                        )
+                    summary = self._versions_summary(local_, remote_, {})
+                    current_errors = {env: dict(clusters) for env, clusters in errors.items()}
+                if sys.stdout.isatty():
+                    print("\033[H\033[J", end='')  # prekreslime tabulku na miste
+                self._print_versions_summary(summary, current_errors, {})
+                self._out("\nWatching {} clusters, updated at {}, press Ctrl+C to stop".format(
+                    len(targets), time.strftime("%H:%M:%S")
+                ))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stop.set()
+            with self.lock:
+                for process in processes:
+                    process.terminate()
+
+    @staticmethod
+    def _versions_summary(local_: Dict, remote_: Dict, ages: Dict) -> Dict[str, Any]:
         summary = {}  # type: Dict[str, Any]
         for env in local_:
             for image in local_[env]:
                 summary.setdefault(env, {}).setdefault(
-                    image, {'local': None, 'remote': {}}
+                    image, {'local': None, 'remote': {}, 'remote_age': {}}
                 )["local"] = local_[env][image]
         for env in remote_:
             for cluster in remote_[env]:
                 for image in remote_[env][cluster]:
-                    summary.setdefault(env, {}).setdefault(
-                        image, {'local': None, 'remote': {}}
-                    )["remote"][cluster] = remote_[env][cluster][image]
-
-        if self.args.json:
-            print(json.dumps(summary, indent=1))
-
+                    vers = summary.setdefault(env, {}).setdefault(
+                        image, {'local': None, 'remote': {}, 'remote_age': {}}
+                    )
+                    vers["remote"][cluster] = remote_[env][cluster][image]
+                    vers["remote_age"][cluster] = int(ages.get(env, {}).get(cluster, 0))
+        return summary
+
+    def _print_versions_summary(self, summary: Dict[str, Any], errors: Dict, ages: Dict) -> None:
         self._out("\nImage and version for defined environments")
         for env in summary:
             self._out("\n{}:".format(env))
@@ -659,29 +1731,97 @@ class Vindaloo:
                 vers = summary[env][image_]
                 warning = ""
                 for cluster in self.envs_config_module.ENVS[env]['k8s_clusters']:
-                    if vers["local"] != vers["remote"].get(cluster):
+                    if cluster not in errors.get(env, {}) and vers["local"] != vers["remote"].get(cluster):
                         warning = " [DIFFERS]"
                 self._out("Image: {} in config: {}, on server: {} {}".format(
                     image_, vers["local"], vers["remote"], warning
                 ))
+            for cluster, age in ages.get(env, {}).items():
+                self._out("Cluster: {} {}".format(cluster, "cached {}s ago".format(int(age)) if age else "fresh"))
+            for cluster, error in errors.get(env, {}).items():
+                self._out("Cluster: {} [ERROR] {}".format(cluster, error))
 
-    def get_k8s_deployment_version(self, module_name: str) -> List[str]:
+    @staticmethod
+    def _print_versions_record(
+            local_: Dict, env: str, cluster: str, images: Dict[str, str], error: Optional[str], age: float
+    ) -> None:
         """
-        List of deployed images for deployment.
+        Prints NDJSON records of one env/cluster: one per image or one with error.
         """
-        res = self.cmd([
-            "kubectl", "get", "deployment", module_name,
-            "-o=jsonpath='{$.spec.template.spec.containers[*].image}'"
-        ], get_stdout=True)
-        if res.returncode == 0 and res.stdout:
-            output = res.stdout.decode("utf-8").strip("'").split(" ")
-            return output
+        if error:
+            records = [{'env': env, 'cluster': cluster, 'error': error}]
         else:
-            return []
+            records = [
+                {
+                    'env': env,
+                    'cluster': cluster,
+                    'image': image,
+                    'local': local_.get(env, {}).get(image),
+                    'remote': images.get(image),
+                    'remote_age': int(age),
+                }
+                for image in list(local_.get(env, {})) + [i for i in images if i not in local_.get(env, {})]
+            ]
+        for record in records:
+            print(json.dumps(record), flush=True)
 
-    def _select_k8s_context(self, env: str, cluster: str) -> None:
+    def get_k8s_images_inventory(self, kubectl: List[str], timeout: float = None) -> Dict[Tuple[str, str, str], str]:
         """
-        Change K8S context
+        Images of all deployments, cronjobs and jobs in namespace (one kubectl call),
+        keyed by (kind, name, container).
+
+        Raises CalledProcessError when kubectl fails and TimeoutExpired when it does not finish in `timeout`.
+        """
+        inventories = self._get_k8s_images_inventories(kubectl, [], timeout)
+        return next(iter(inventories.values())) if inventories else {}
+
+    def get_k8s_images_inventories(
+            self, kubectl: List[str], timeout: float = None, selector: str = None
+    ) -> Dict[str, Dict[Tuple[str, str, str], str]]:
+        """
+        Images inventories of all namespaces in cluster (one kubectl call), keyed by namespace.
+        """
+        return self._get_k8s_images_inventories(
+            kubectl, ["--all-namespaces"] + (["--selector", selector] if selector else []), timeout
+        )
+
+    def _get_k8s_images_inventories(
+            self, kubectl: List[str], options: List[str], timeout: float = None
+    ) -> Dict[str, Dict[Tuple[str, str, str], str]]:
+        import subprocess
+        res = self.kubectl_cmd(
+            kubectl, ["get", ",".join(kind + "s" for kind in VERSIONS_OBJECT_TYPES)] + options + ["-o", "json"],
+            check_login=False, get_stdout=True, timeout=timeout,
+        )
+        if res.returncode != 0:
+            raise subprocess.CalledProcessError(res.returncode, res.args, res.stdout, res.stderr)
+        if not res.stdout:
+            return {}
+
+        inventories = {}  # type: Dict[str, Dict[Tuple[str, str, str], str]]
+        for item in json.loads(res.stdout.decode("utf-8")).get('items', []):
+            spec = item['spec']
+            if 'jobTemplate' in spec:  # cronjob
+                spec = spec['jobTemplate']['spec']
+            inventory = inventories.setdefault(item['metadata'].get('namespace', ''), {})
+            for container in spec['template']['spec'].get('containers', []):
+                inventory[(item['kind'].lower(), item['metadata']['name'], container['name'])] = container['image']
+        return inventories
+
+    @staticmethod
+    def _kubectl_error(ex: 'subprocess.SubprocessError') -> str:
+        """
+        Short description of failed kubectl call.
+        """
+        import subprocess
+        if isinstance(ex, subprocess.TimeoutExpired):
+            return "timed out after {}s".format(ex.timeout)
+        stderr = (getattr(ex, 'stderr', None) or b'').decode("utf-8").strip()
+        return stderr.splitlines()[-1] if stderr else "kubectl exited with {}".format(getattr(ex, 'returncode', None))
+
+    def _resolve_cluster(self, env: str, cluster: str) -> str:
+        """
+        Returns cluster name with resolved alias, first cluster of env when no cluster given.
         """
         if (
                 hasattr(self.envs_config_module, 'K8S_CLUSTER_ALIASES') and
@@ -692,20 +1832,72 @@ class Vindaloo:
         if not cluster:
             cluster = self.envs_config_module.ENVS[env]['k8s_clusters'][0]
 
-        context = '{}:{}'.format(self.envs_config_module.ENVS[env]['k8s_namespace'], cluster)
+        return cluster
+
+    def _k8s_context_name(self, env: str, cluster: str) -> str:
+        return '{}:{}'.format(self.envs_config_module.ENVS[env]['k8s_namespace'], self._resolve_cluster(env, cluster))
+
+    def _kubectl_base(self, env: str, cluster: str) -> List[str]:
+        """
+        Beginning of kubectl command with explicit context and namespace, so current context does not matter.
+        """
+        return [
+            "kubectl",
+            "--context", self._k8s_context_name(env, cluster),
+            "--namespace", self.envs_config_module.ENVS[env]['k8s_namespace'],
+        ]
+
+    def _create_k8s_context(self, env: str, cluster: str) -> None:
+        """
+        Asks user whether missing K8S context should be created and creates it.
+        """
+        context = self._k8s_context_name(env, cluster)
+        cluster = self._resolve_cluster(env, cluster)
+
+        if not self._confirm("K8s context is not set {}. Should I create it?".format(context)):
+            self._out('Deploy action terminated')
+            sys.exit(0)
+        username = self._input_text("Insert username for cluster {}: ".format(cluster))
+        assert self._cmd_check([
+            "kubectl", "config", "set-context", context, "--cluster={}".format(
+                cluster
+            ),
+            "--namespace={}".format(
+                self.envs_config_module.ENVS[env]['k8s_namespace']
+            ), "--user={}".format(username)])
+
+    def _ensure_k8s_context(self, env: str, cluster: str) -> str:
+        """
+        Checks that K8S context exists (creates it when needed) without switching to it.
+        """
+        context = self._k8s_context_name(env, cluster)
+        if context in self.known_contexts:
+            return context
+
+        if self.k8s_contexts is None:
+            self.k8s_contexts = self._list_k8s_contexts()
+        if context not in self.k8s_contexts and not self._cmd_check(["kubectl", "config", "get-contexts", context], True):
+            self._create_k8s_context(env, cluster)
+        self.known_contexts.add(context)
+        return context
+
+    def _list_k8s_contexts(self) -> Set[str]:
+        """
+        Names of all K8S contexts (one kubectl call), empty when they can't be listed.
+        """
+        res = self.cmd(["kubectl", "config", "get-contexts", "-o", "name"], get_stdout=True)
+        if res.returncode != 0 or not isinstance(res.stdout, bytes):  # e.g. --dryrun
+            return set()
+        return set(res.stdout.decode('utf-8').split())
+
+    def _select_k8s_context(self, env: str, cluster: str) -> None:
+        """
+        Change K8S context
+        """
+        context = self._k8s_context_name(env, cluster)
 
         if not self._cmd_check(["kubectl", "config", "use-context", context], self.args.quiet):
-            if not self._confirm("K8s context is not set {}. Should I create it?".format(context)):
-                self._out('Deploy action terminated')
-                sys.exit(0)
-            username = self._input_text("Insert username for cluster {}: ".format(cluster))
-            assert self._cmd_check([
-                "kubectl", "config", "set-context", context, "--cluster={}".format(
-                    cluster
-                ),
-                "--namespace={}".format(
-                    self.envs_config_module.ENVS[env]['k8s_namespace']
-                ), "--user={}".format(username)])
+            self._create_k8s_context(env, cluster)
             assert self._cmd_check(["kubectl", "config", "use-context", context], self.args.quiet)
             self._out("Environment changed to {} ({})".format(env, context))
 
@@ -720,14 +1912,8 @@ class Vindaloo:
         """
         Creates Dockerfile/yaml file using given template and config dict.
         """
-        if from_templates:
-            src_file = "{}/templates/{}".format(CONFIG_DIR, template_file_name)
-        else:
-            src_file = "{}/{}".format(CONFIG_DIR, template_file_name)
-
-        with open(src_file, "r") as template_file:
-            # render using given variables
-            data = chevron.render(template_file, conf)
+        import tempfile
+        data = self.render_template(template_file_name, conf, from_templates=from_templates)
 
         if force_dest_file:
             temp_file = open(force_dest_file, "w+b")
@@ -744,35 +1930,96 @@ class Vindaloo:
 
         return temp_file
 
-    def _create_json_file_from_object(
-            self,
-            obj: JsonSerializable,
-            force_dest_file: str = None,
-            no_edit=False
-    ) -> BinaryIO:
+    @timed('template rendering')
+    def render_template(self, template_file_name: str, conf: Dict, from_templates: bool = False) -> str:
         """
-        Creates JSON file using given object.
+        Renders template using given config dict.
         """
-        if force_dest_file:
-            temp_file = open(force_dest_file, "wb")
+        import chevron
+        if from_templates:
+            src_file = "{}/templates/{}".format(CONFIG_DIR, template_file_name)
         else:
-            temp_file = tempfile.NamedTemporaryFile("wb")
+            src_file = "{}/{}".format(CONFIG_DIR, template_file_name)
 
-        temp_file.write(bytes(
-            json.dumps(obj.serialize(app=self), indent=4),
-            'utf-8'
-        ))
-        temp_file.seek(0)
+        with open(src_file, "r") as template_file:
+            # render using given variables
+            return chevron.render(template_file, conf)
 
-        # Optionally offers edit
-        if not self.args.noninteractive and not no_edit:
-            if self._confirm("File {}-{}.json was created. Do you want to modify it?".format(obj.name, obj.obj_type), default="n"):
-                self._open_in_editor(temp_file)
+    @timed('object serialization')
+    def _serialize_object(self, obj: JsonSerializable) -> bytes:
+        """
+        Serializes object into JSON manifest.
+        """
+        return bytes(json.dumps(obj.serialize(app=self), indent=4), 'utf-8')
 
-        return temp_file
+    def _stamp_manifest(self, data: bytes) -> Tuple[bytes, Optional[List[str]]]:
+        """
+        Stamps rendered (and possibly edited) manifest with digest annotation.
+
+        Returns the manifest (as JSON) with [kind, name, digest] to compare with the live object. Manifests
+        which can't be parsed or serialized back are returned as they are without stamp and are always applied.
+        """
+        try:
+            document = json.loads(data.decode('utf-8'))
+        except ValueError:
+            import yaml
+            try:
+                document = yaml.safe_load(data)
+            except yaml.YAMLError:  # nevalidni YAML nebo vic dokumentu, nechame na kubectl
+                return data, None
+
+        if not isinstance(document, dict) or not document.get('kind') or not isinstance(document.get('metadata'), dict):
+            return data, None
+        name = document['metadata'].get('name')
+        if not name:
+            return data, None
+
+        try:
+            self._stamp_digest(document)
+            stamped = bytes(json.dumps(document, indent=4, default=str), 'utf-8')
+        except (TypeError, ValueError):  # napr. klic, ktery neni string
+            return data, None
+        stamp = [document['kind'].lower(), name, document['metadata']['annotations'][DIGEST_ANNOTATION]]
+        return stamped, stamp
+
+    def _offer_edit(self, file_label: str, data: bytes) -> bytes:
+        """
+        Optionally lets user modify the manifest in editor, only then it is written into temporary file.
+        """
+        import tempfile
+        if self.args.noninteractive:
+            return data
+
+        if not self._confirm("File {} was created. Do you want to modify it?".format(file_label), default="n"):
+            return data
+
+        with tempfile.NamedTemporaryFile("w+b") as temp_file:
+            temp_file.write(data)
+            temp_file.flush()
+            self._open_in_editor(temp_file)
+            # read by name, the file could be replaced by editor
+            with open(temp_file.name, 'rb') as fp:
+                return fp.read()
+
+    @staticmethod
+    def _digest(data: bytes) -> str:
+        import hashlib
+        return hashlib.sha256(data).hexdigest()
+
+    def _stamp_digest(self, data: Dict[str, Any]) -> None:
+        """
+        Adds annotation with digest of serialized object content into its metadata.
+        """
+        metadata = data.setdefault('metadata', {})
+        annotations = metadata.get('annotations') or {}
+        annotations.pop(DIGEST_ANNOTATION, None)
+        metadata['annotations'] = annotations
+        # YAML muze obsahovat napr. datumy, ty kubectl stejne posle jako stringy
+        annotations[DIGEST_ANNOTATION] = self._digest(bytes(json.dumps(data, sort_keys=True, default=str), 'utf-8'))
 
     @staticmethod
     def _open_in_editor(temp_file: Any) -> None:
+        import subprocess
         editor = os.getenv('EDITOR', 'vi')
         subprocess.call('{} {}'.format(editor, temp_file.name), shell=True)
 
@@ -781,6 +2028,7 @@ class Vindaloo:
         returns config with includes made from templates
         using same config.
         """
+        import chevron
         new_context = {}  # type: Dict[str, Any]
 
         # If there are includes, then we pregenerate them and include in context
@@ -806,22 +2054,67 @@ class Vindaloo:
 
         self.create_file(conf['template'], tmp_config, force_dest_file="Dockerfile", from_templates=True)
 
-    def _check_version(self):
+    def _check_version(self) -> None:
+        """
+        Finds out the latest version of vindaloo without delaying the command.
+
+        Version remembered within CHECK_VERSION_INTERVAL is used, otherwise it is fetched in background thread
+        for the next run (or for the end of this one). Disabled by VINDALOO_NO_VERSION_CHECK env variable
+        or `CHECK_VERSION = False` in vindaloo_conf.py.
+        """
+        if os.getenv(CHECK_VERSION_ENV) or not getattr(self.envs_config_module, 'CHECK_VERSION', True):
+            return
+
+        try:
+            cache_path = os.path.join(self._cache_dir(), CHECK_VERSION_CACHE_FILE)
+        except OSError:
+            return
+        known_version = None
         try:
-            context = ssl.create_default_context()
-            context.check_hostname = False
-            context.verify_mode = ssl.CERT_NONE
-            with urllib.request.urlopen(CHECK_VERSION_URL, timeout=0.5, context=context) as f:
-                data = json.loads(f.read())
-                if data.get('version') != VERSION:
-                    self._out('Newer version found: {}, current version: {}'.format(
-                        data.get('version'),
-                        VERSION,
-                    ))
-        except Exception:
+            with open(cache_path, 'r') as fp:
+                cached = json.load(fp)
+            known_version = cached['version']
+            if 0 <= time.time() - cached['time'] < CHECK_VERSION_INTERVAL:
+                self.latest_version = known_version
+                return
+        except (OSError, ValueError, KeyError, TypeError):
             pass
 
+        # pokus zaznamename predem, command muze skoncit (a zabit vlakno) driv nez fetch dobehne nebo vyprsi
+        try:
+            with open(cache_path, 'w') as fp:
+                json.dump({'time': time.time(), 'version': known_version}, fp)
+        except OSError:
+            return
+
+        def fetch_latest_version() -> None:
+            import ssl
+            import urllib.request
+            try:
+                context = ssl.create_default_context()
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+                with urllib.request.urlopen(CHECK_VERSION_URL, timeout=5, context=context) as f:
+                    version = json.loads(f.read()).get('version')
+            except Exception:
+                return
+            self.latest_version = version
+            try:
+                with open(cache_path, 'w') as fp:
+                    json.dump({'time': time.time(), 'version': version}, fp)
+            except OSError:
+                pass
+
+        # daemon thread does not keep vindaloo running when the command is done sooner
+        self.version_check = threading.Thread(target=fetch_latest_version, daemon=True)
+        self.version_check.start()
+
+    def _print_newer_version(self) -> None:
+        if self.latest_version and self.latest_version != VERSION:
+            self._out('Newer version found: {}, current version: {}'.format(self.latest_version, VERSION))
+
     def output_completion(self):
+        import argcomplete
         self._out(argcomplete.shellcode(
             ['vindaloo'],
             False,
@@ -829,8 +2122,13 @@ class Vindaloo:
         ))
 
     def edit_secret(self) -> None:
-        self.k8s_select_env()
-        res = self.cmd(["kubectl", "get", "secrets", "-o", "json"], get_stdout=True, run_always=True)
+        dep_env = self.args.environment
+        if dep_env not in self.envs_config_module.ENVS:
+            self.fail("Unknown environment '{}'.".format(dep_env))
+        self._ensure_k8s_context(dep_env, self.args.cluster)
+
+        kubectl = self._kubectl_base(dep_env, self.args.cluster)
+        res = self.kubectl_cmd(kubectl, ["get", "secrets", "-o", "json"], get_stdout=True, run_always=True)
         json_data = json.loads(res.stdout.decode('utf-8'))
         secrets = self._parse_secrets(json_data)
         while self._select_secret(secrets):
@@ -925,6 +2223,8 @@ class Vindaloo:
 
     @staticmethod
     def _edit_value(val: bytes) -> bytes:
+        import subprocess
+        import tempfile
         file_, path_ = tempfile.mkstemp()
         try:
             os.write(file_, val)
@@ -950,8 +2250,9 @@ class Vindaloo:
                 base64.encodebytes(val).decode("utf-8").replace("\n", "")
             ) for key, val in self.changed_secrets.items()
         ]
-        cmd = ["kubectl", "patch", "secret", item["name"], "-p", "{{\"data\":{{{}}}}}".format(",".join(changed))]
-        res = self.cmd(cmd)
+        res = self.kubectl_cmd(self._kubectl_base(self.args.environment, self.args.cluster), [
+            "patch", "secret", item["name"], "-p", "{{\"data\":{{{}}}}}".format(",".join(changed))
+        ])
         assert res.returncode == 0
 
         print("Saved!")
@@ -981,6 +2282,10 @@ class Vindaloo:
             self.k8s_deploy()
         elif command == "kubeenv":
             self.k8s_select_env()
+        elif command == "compile":
+            self.compile_bundle()
+        elif command == "apply-bundle":
+            self.apply_bundle()
         elif command == "build-push-deploy":
             self.build_images()
             self.push_images()
@@ -995,7 +2300,7 @@ class Vindaloo:
 
     def _image_completer(self, **kwargs):
         if not self.config_module:
-            self.config_module = self._import_config(NONE)
+            self.config_module = self._config_snapshot(NONE)
 
         if not self.config_module:
             return []
@@ -1006,6 +2311,34 @@ class Vindaloo:
             images.append(self._strip_image_name(image_name))
         return images
 
+    @staticmethod
+    def _add_deploy_args(parser: argparse.ArgumentParser, clusters_str: str) -> None:
+        """
+        Options shared by deploy, apply-bundle and build-push-deploy.
+        """
+        parser.add_argument(
+            '--batch', help='Apply all objects in a single kubectl call',
+            action='store_true'
+        )
+        parser.add_argument(
+            '--all-clusters', help='Deploy to all clusters of the environment in parallel',
+            action='store_true'
+        )
+        parser.add_argument(
+            '--clusters', help='Deploy to given clusters in parallel ({})'.format(clusters_str),
+        )
+        parser.add_argument(
+            '--workers', help='Maximal number of clusters deployed at once', type=int, default=DEFAULT_DEPLOY_WORKERS
+        )
+        parser.add_argument(
+            '--apply-workers', help='Maximal number of objects of the same priority applied at once',
+            type=int, default=DEFAULT_APPLY_WORKERS
+        )
+        parser.add_argument(
+            '--force', help='Apply also objects whose live copy in the cluster has the same digest',
+            action='store_true'
+        )
+
     def get_arg_parser(self) -> argparse.ArgumentParser:
         envs = getattr(self.envs_config_module, 'ENVS', {})
         environments = envs.keys() if self.envs_config_module else tuple()
@@ -1023,6 +2356,8 @@ class Vindaloo:
         parser.add_argument('--noninteractive', action='store_true', help='Does not ask questions')
         parser.add_argument('--quiet', action='store_true', help='Suppress output')
         parser.add_argument('--dryrun', action='store_true', help='Just pretends, no changes are actually done')
+        parser.add_argument('--timings', action='store_true', help='Print duration of individual phases to stderr')
+        parser.add_argument('--timings-json', action='store_true', help='Print duration of individual phases as JSON to stderr')
 
         subparsers = parser.add_subparsers(title='commands', dest='command')
 
@@ -1079,6 +2414,22 @@ class Vindaloo:
 
         versions_parser = subparsers.add_parser('versions', help='list all images and compares to the cluster')
         versions_parser.add_argument('--json', help='output as json', action='store_true')
+        versions_parser.add_argument(
+            '--ndjson', help='stream one json record per image and cluster as soon as it is known',
+            action='store_true'
+        )
+        versions_parser.add_argument(
+            '--workers', help='Maximal number of clusters queried at once', type=int, default=DEFAULT_VERSIONS_WORKERS
+        )
+        versions_parser.add_argument(
+            '--timeout', help='Seconds to wait for one cluster', type=float, default=DEFAULT_VERSIONS_TIMEOUT
+        )
+        versions_parser.add_argument(
+            '--refresh', help='Ignore cached versions and ask the clusters', action='store_true'
+        )
+        versions_parser.add_argument(
+            '--watch', help='Keep the table updated as deployments change (until Ctrl+C)', action='store_true'
+        )
         versions_parser.add_argument(
             'environment',
             help='env for which we want comparison',
@@ -1091,6 +2442,7 @@ class Vindaloo:
             '--watch', help='Wait for rollout of new version',
             action='store_true'
         )
+        self._add_deploy_args(deploy_parser, clusters_str)
         deploy_parser.add_argument(
             'environment', help='environment for deployment',
             choices=environments
@@ -1122,6 +2474,28 @@ class Vindaloo:
             default=False
         )
 
+        compile_parser = subparsers.add_parser(
+            'compile', help='render manifests of all environments and clusters into bundle for apply-bundle'
+        )
+        compile_parser.add_argument('--output-dir', help='bundle directory', default='bundle')
+
+        apply_bundle_parser = subparsers.add_parser('apply-bundle', help='Deploy manifests of compiled bundle to cluster')
+        apply_bundle_parser.add_argument('bundle', help='bundle directory created by compile')
+        apply_bundle_parser.add_argument(
+            'environment', help='environment for deployment',
+            choices=environments
+        )
+        apply_bundle_parser.add_argument(
+            'cluster', help='cluster name ({})'.format(clusters_str),
+            choices=clusters,
+            nargs='?'
+        )
+        apply_bundle_parser.add_argument(
+            '--watch', help='Wait for rollout of new version',
+            action='store_true'
+        )
+        self._add_deploy_args(apply_bundle_parser, clusters_str)
+
         bpd_parser = subparsers.add_parser('build-push-deploy', help='makes all three steps in one')
         bpd_parser.add_argument(
             'environment', help='environment for deployment',
@@ -1143,6 +2517,7 @@ class Vindaloo:
             '--watch', help='Wait for the new version to rollout',
             action='store_true'
         )
+        self._add_deploy_args(bpd_parser, clusters_str)
         bpd_parser.add_argument(
             '--apply-output-dir',
             help="Instead of apply save generated yaml files to specified directory",
@@ -1163,11 +2538,44 @@ class Vindaloo:
 
         subparsers.add_parser('completion', help='list commands for bash completion')
 
-        argcomplete.autocomplete(parser)
+        if '_ARGCOMPLETE' in os.environ:  # argcomplete does nothing unless called by bash completion
+            import argcomplete
+            argcomplete.autocomplete(parser)
 
         return parser
 
+    def _record_timing(self, phase: str, duration: float) -> None:
+        with self.lock:
+            timing = self.timings.setdefault(phase, [0, 0.0])
+            timing[0] += 1
+            timing[1] += duration
+
+    def _print_timings(self, total: float) -> None:
+        """
+        Prints duration of individual phases of the command to stderr (stdout may contain JSON output).
+        """
+        if self.args.timings_json:
+            data = {
+                'command': self.args.command,
+                'total': round(total, 3),
+                'phases': {
+                    phase: {'calls': calls, 'total': round(duration, 3)}
+                    for phase, (calls, duration) in self.timings.items()
+                },
+            }
+            print(json.dumps(data), file=sys.stderr)
+            return
+
+        lines = ["", "{:<24} {:>6} {:>10}".format("Phase", "Calls", "Total [s]")]
+        for phase, (calls, duration) in sorted(self.timings.items(), key=lambda item: -item[1][1]):
+            lines.append("{:<24} {:>6} {:>10.3f}".format(phase, calls, duration))
+        lines.append("{:<24} {:>6} {:>10.3f}".format("total (wall time)", "", total))
+        print("\n".join(lines), file=sys.stderr)
+
     def main(self) -> None:
+        start = time.monotonic()
+        # configs get their own `app` (see ConfigLoader), global one is kept for code outside k8s dir
+        sys.modules['vindaloo'].app = self
         self._import_envs_config()
 
         if len(sys.argv) > 1 and sys.argv[1] not in DO_NOT_NEED_CONFIG_FILE:
@@ -1184,10 +2592,11 @@ class Vindaloo:
         if not self.args.command:
             parser.print_help()
 
-        if getattr(self.args, 'json', None):
+        if getattr(self.args, 'json', None) or getattr(self.args, 'ndjson', None):
             self.args.quiet = True
 
-        self.config_module = self._import_config(NONE)
+        # deploy evaluates configs itself, other commands only read images (and objects) of base config
+        self.config_module = self._config_snapshot(NONE)
 
         if self.args.command != 'completion':
             self._check_version()
@@ -1196,10 +2605,20 @@ class Vindaloo:
             if not self._check_current_dir() and self.args.command not in DO_NOT_NEED_K8S_DIR:
                 self.fail("Directory does not contain k8s subdirectory or Dockerfile is missing. Are we in module directory?")
 
-        if self.args.command in NEEDS_K8S_LOGIN and not self._am_i_logged_in():
-            self.fail("You are not logged in Kubernetes")
+        if self.args.command in CHECK_K8S_LOGIN_FIRST and self.args.environment in self.envs_config_module.ENVS:
+            self._ensure_k8s_context(self.args.environment, self.args.cluster)
+            kubectl = self._kubectl_base(self.args.environment, self.args.cluster)
+            if not self._is_login_verified(kubectl):
+                if not self._am_i_logged_in(kubectl):
+                    self.fail("You are not logged in Kubernetes")
+                self._store_login_verified(kubectl)
 
-        self.do_command()
+        try:
+            self.do_command()
+        finally:
+            self._print_newer_version()
+            if self.args.timings or self.args.timings_json:
+                self._print_timings(time.monotonic() - start)
 
 
 def run():